@@ -0,0 +1,134 @@
+import sys
+sys.path.append("./src")
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from gym_trading_env import downloader
+from gym_trading_env.utils.fake_exchange import FakeExchange
+from gym_trading_env.utils.dataset_formats import read_dataset
+from benchmark_environments import peak_memory_mb, git_commit, run_case_in_process, compare
+
+# Benchmark of the download pipeline against a local fake exchange (no network access) : candles per second, requests and peak memory of every case.
+# Each case runs in a new process, so that the peak memory of a case does not include the previous ones.
+#
+#   python benchmarks/benchmark_downloader.py --output results.json
+#   python benchmarks/benchmark_downloader.py --compare results.json   (after a change, to compare with the previous results)
+
+# name -> (parameters of FakeExchange, parameters of download)
+CASES = {
+    "no_latency" : ({}, {}),
+    "latency" : ({"latency" : 0.05}, {}),
+    "rate_limited" : ({"latency" : 0.02, "rate_limit" : 20}, {}),
+    "network_errors" : ({"latency" : 0.02, "error_rate" : 0.05}, {}),
+    "gaps_and_duplicates" : ({"latency" : 0.02, "gap_rate" : 0.01, "duplicate_rate" : 0.01}, {}),
+    "partitioned" : ({"latency" : 0.02}, {"partition" : "month"}),
+    "update" : ({"latency" : 0.02, "gap_rate" : 0.01}, {"update" : True}),
+    "update_up_to_date" : ({"latency" : 0.02, "gap_rate" : 0.01}, {"update" : True}),
+}
+# Proportion of the candles missing before the update of the update cases
+UPDATE_MISSING_CANDLES = {"update" : 0.1, "update_up_to_date" : 0}
+
+def run_case(name, config):
+    exchange_parameters, download_parameters = CASES[name]
+    downloader.EXCHANGE_LIMIT_RATES["fake"] = {"limit" : config["limit"], "pause_every" : config["pause_every"], "pause" : config["pause"], "max_rate" : config["max_rate"]}
+    exchanges = []
+    def exchange_factory(exchange_name):
+        exchanges.append(FakeExchange(seed= config["seed"], **exchange_parameters))
+        return exchanges[-1]
+    symbols = [f"SYMBOL{i}/USDT" for i in range(config["nb_symbols"])]
+    timedelta = pd.Timedelta(config["timeframe"])
+    since = datetime.datetime(year= 2020, month= 1, day= 1)
+    until = since + config["nb_candles"] * timedelta
+    with tempfile.TemporaryDirectory() as dir:
+        download = lambda since, until, **kwargs : downloader.download(
+            exchange_names= ["fake"], symbols= symbols, timeframe= config["timeframe"], dir= dir, since= since, until= until,
+            format= config["format"], exchange_factory= exchange_factory, **kwargs
+        )
+        with contextlib.redirect_stdout(io.StringIO()):
+            if download_parameters.get("update", False):
+                # Only the last candles are missing
+                download(since, until - int(config["nb_candles"] * UPDATE_MISSING_CANDLES[name]) * timedelta)
+                exchanges.clear()
+            start = time.perf_counter()
+            download(since, until, **download_parameters)
+            duration = time.perf_counter() - start
+        # Check the stored datasets : every candle of the exchange in (since, until), once, in order
+        nb_stored_candles = 0
+        for symbol in symbols:
+            path = os.path.join(dir, f"fake-{symbol.replace('/', '')}-{config['timeframe']}")
+            df = read_dataset(path if "partition" in download_parameters else path + downloader.get_dataset_format(format= config["format"]).extensions[0])
+            expected = [candle[0] for candle in FakeExchange(gap_rate= exchange_parameters.get("gap_rate", 0)).candles(symbol, config["timeframe"], int(since.timestamp() * 1E3) + 1, config["nb_candles"] - 1)]
+            timestamps = df.index.values.astype("datetime64[ms]").astype(np.int64)
+            if not np.array_equal(timestamps, np.array(expected, dtype= np.int64)):
+                raise ValueError(f"The stored candles of {symbol} are not the candles of the exchange")
+            nb_stored_candles += len(df)
+    peak_memory, _ = peak_memory_mb()
+    nb_downloaded_candles = sum(exchange.stats["candles"] for exchange in exchanges)
+    return {
+        "candles_per_second" : nb_downloaded_candles / duration,
+        "duration" : duration,
+        "downloaded_candles" : nb_downloaded_candles,
+        "stored_candles" : nb_stored_candles,
+        "requests" : sum(exchange.stats["requests"] for exchange in exchanges),
+        "rate_limited" : sum(exchange.stats["rate_limited"] for exchange in exchanges),
+        "errors" : sum(exchange.stats["errors"] for exchange in exchanges),
+        "peak_memory_mb" : peak_memory,
+    }
+
+def run_benchmark(cases, config):
+    results = {}
+    for name in cases:
+        # Best of the repeats, the least disturbed by the other processes of the machine
+        runs = [run_case_in_process(name, config, run= run_case) for _ in range(config["repeat"])]
+        results[name] = max(runs, key= lambda run : run["candles_per_second"])
+        print(f"{name:30} {results[name]['candles_per_second']:12,.0f} candles/s {results[name]['requests']:8} requests", file= sys.stderr)
+    return {
+        "date" : datetime.datetime.now().isoformat(timespec= "seconds"),
+        "commit" : git_commit(),
+        "platform" : platform.platform(),
+        "python" : platform.python_version(),
+        "versions" : {"numpy" : np.__version__, "pandas" : pd.__version__},
+        "config" : config,
+        "results" : results,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description= "Benchmark of the downloader against a local fake exchange.")
+    parser.add_argument("--cases", nargs= "+", default= list(CASES.keys()), choices= list(CASES.keys()))
+    parser.add_argument("--nb-symbols", type= int, default= 4)
+    parser.add_argument("--nb-candles", type= int, default= 200_000, help= "Number of candles of each symbol.")
+    parser.add_argument("--timeframe", default= "1m")
+    parser.add_argument("--format", default= "pickle")
+    parser.add_argument("--limit", type= int, default= 1000, help= "Number of candles per request.")
+    parser.add_argument("--pause-every", type= int, default= 10, help= "Initial rate of the rate limiter : 'pause_every' requests every 'pause' seconds.")
+    parser.add_argument("--pause", type= float, default= 1)
+    parser.add_argument("--max-rate", type= float, default= None, help= "Maximum number of requests per second of the rate limiter. Default : twice the initial rate.")
+    parser.add_argument("--repeat", type= int, default= 1)
+    parser.add_argument("--seed", type= int, default= 0)
+    parser.add_argument("--output", help= "JSON file of the results. Default : printed.")
+    parser.add_argument("--compare", help= "JSON file of previous results to compare with.")
+    args = parser.parse_args()
+
+    config = {
+        "nb_symbols" : args.nb_symbols, "nb_candles" : args.nb_candles, "timeframe" : args.timeframe, "format" : args.format,
+        "limit" : args.limit, "pause_every" : args.pause_every, "pause" : args.pause, "max_rate" : args.max_rate, "repeat" : args.repeat, "seed" : args.seed,
+    }
+    results = run_benchmark(args.cases, config)
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent= 2)
+    else:
+        print(json.dumps(results, indent= 2))
+    if args.compare is not None:
+        with open(args.compare) as file:
+            print(compare(results, json.load(file), measures= ["candles_per_second", "requests", "peak_memory_mb"]), file= sys.stderr)
@@ -0,0 +1,224 @@
+import sys
+sys.path.append("./src")
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import gymnasium as gym
+import gym_trading_env
+from gym_trading_env.environments import TradingEnv, MultiDatasetTradingEnv
+from gym_trading_env.dynamic_features import LastPosition, RealPosition
+
+# Benchmark of the environments on synthetic data : steps per second, reset latency and peak memory of every case.
+# Each case runs in a new process, so that the peak memory of a case does not include the previous ones.
+#
+#   python benchmarks/benchmark_environments.py --output results.json
+#   python benchmarks/benchmark_environments.py --compare results.json   (after a change, to compare with the previous results)
+
+def make_ohlcv(length, nb_features = 4, seed = 0, start = "2020-01-01"):
+    """Synthetic hourly OHLCV data (geometric random walk) with ``nb_features`` feature columns."""
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, size= length)))
+    open_price = np.concatenate([[100], close[:-1]])
+    spread = np.abs(rng.normal(0, 0.005, size= length))
+    df = pd.DataFrame({
+        "open" : open_price,
+        "high" : np.maximum(open_price, close) * (1 + spread),
+        "low" : np.minimum(open_price, close) * (1 - spread),
+        "close" : close,
+        "volume" : rng.lognormal(10, 1, size= length),
+    }, index= pd.date_range(start, periods= length, freq= "h", name= "date"))
+    features = {"feature_close" : df["close"].pct_change().fillna(0)}
+    for i in range(1, nb_features):
+        features[f"feature_{i}"] = np.tanh(df["close"].pct_change(periods= i + 1).fillna(0) * 10)
+    return pd.concat([df, pd.DataFrame(features)], axis= 1)
+
+def history_dynamic_feature(history):
+    # Dynamic feature computed from the History (instead of a built-in one)
+    return history["portfolio_valuation", -1] / history["portfolio_valuation", 0]
+
+# name -> (kind, parameters of the environment)
+CASES = {
+    "trading_env" : ("env", {}),
+    "trading_env_windows_10" : ("env", {"windows" : 10}),
+    "trading_env_windows_100" : ("env", {"windows" : 100}),
+    "trading_env_positions_21" : ("env", {"positions" : list(np.linspace(-1, 2, 21))}),
+    "trading_env_no_dynamic_features" : ("env", {"dynamic_feature_functions" : []}),
+    "trading_env_history_dynamic_feature" : ("env", {"dynamic_feature_functions" : [LastPosition(), RealPosition(), history_dynamic_feature]}),
+    "trading_env_record_minimal" : ("env", {"record" : "minimal"}),
+    "trading_env_limit_orders" : ("limit_orders", {}),
+    "multi_dataset_env" : ("multi", {}),
+    "multi_dataset_env_uniform" : ("multi", {"dataset_sampling" : "uniform"}),
+    "vector_env_sync" : ("vector", {"vectorization_mode" : "sync"}),
+    "vector_env_async" : ("vector", {"vectorization_mode" : "async"}),
+    "vector_env_async_record_minimal" : ("vector", {"vectorization_mode" : "async", "record" : "minimal"}),
+}
+
+def peak_memory_mb():
+    # Peak resident memory of the process and of its terminated child processes (None where the resource module is missing, eg. Windows)
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    unit = 1 if sys.platform == "darwin" else 1024 # ru_maxrss is in bytes on macOS, in kilobytes elsewhere
+    return (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 2**20,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / 2**20,
+    )
+
+def run_steps(env, nb_steps, rng, limit_orders = False):
+    env.reset(seed= 0)
+    actions = rng.integers(env.action_space.n, size= nb_steps)
+    start = time.perf_counter()
+    for action in actions:
+        if limit_orders:
+            price = env._get_price()
+            env.add_limit_order(position= env.positions[0], limit= price * 0.99, duration= 10)
+            env.add_limit_order(position= env.positions[-1], limit= price * 1.01, duration= 10)
+        _, _, done, truncated, _ = env.step(action)
+        if done or truncated: env.reset()
+    return nb_steps / (time.perf_counter() - start)
+
+def run_vector_steps(envs, nb_steps, rng):
+    envs.reset(seed= 0)
+    nb_vector_steps = max(1, nb_steps // envs.num_envs)
+    actions = rng.integers(envs.single_action_space.n, size= (nb_vector_steps, envs.num_envs))
+    start = time.perf_counter()
+    for action in actions:
+        envs.step(action)
+    return nb_vector_steps * envs.num_envs / (time.perf_counter() - start)
+
+def run_resets(env, nb_resets):
+    env.reset(seed= 0)
+    latencies = []
+    for _ in range(nb_resets):
+        start = time.perf_counter()
+        env.reset()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def run_case(name, config):
+    kind, parameters = CASES[name]
+    rng = np.random.default_rng(config["seed"])
+    df = make_ohlcv(config["length"], nb_features= config["nb_features"], seed= config["seed"])
+    env_parameters = {"positions" : [-1, 0, 1], "trading_fees" : 0.01/100, "borrow_interest_rate" : 0.0003/100, "verbose" : 0, **parameters}
+    start = time.perf_counter()
+    latencies = None
+    if kind == "vector":
+        envs = gym.make_vec("TradingEnv", num_envs= config["num_envs"], df= df, **env_parameters)
+        setup_time = time.perf_counter() - start
+        steps_per_second = run_vector_steps(envs, config["steps"], rng)
+        latencies = run_resets(envs, config["resets"])
+        envs.close()
+    else:
+        with tempfile.TemporaryDirectory() as dataset_dir:
+            if kind == "multi":
+                # Datasets of different lengths, written as pickle files
+                for i in range(config["nb_datasets"]):
+                    make_ohlcv(config["length"] * (i + 1) // config["nb_datasets"], nb_features= config["nb_features"], seed= config["seed"] + i).to_pickle(os.path.join(dataset_dir, f"dataset_{i}.pkl"))
+                env = MultiDatasetTradingEnv(dataset_dir= os.path.join(dataset_dir, "*.pkl"), **env_parameters)
+            else:
+                env = TradingEnv(df= df, **env_parameters)
+            setup_time = time.perf_counter() - start
+            steps_per_second = run_steps(env, config["steps"], rng, limit_orders= kind == "limit_orders")
+            latencies = run_resets(env, config["resets"])
+            env.close()
+    peak_memory, peak_memory_children = peak_memory_mb()
+    return {
+        "steps_per_second" : steps_per_second,
+        "setup_time" : setup_time,
+        "reset_latency_mean" : None if latencies is None else float(np.mean(latencies)),
+        "reset_latency_median" : None if latencies is None else float(np.median(latencies)),
+        "peak_memory_mb" : peak_memory,
+        "peak_memory_children_mb" : peak_memory_children,
+    }
+
+def _run_case_in_process(run, name, config, queue):
+    try:
+        queue.put(("ok", run(name, config)))
+    except Exception as error:
+        queue.put(("error", f"{type(error).__name__}: {error}"))
+
+def run_case_in_process(name, config, run = run_case):
+    # A regular (non daemonic) process : the async vector environment can start its own workers
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target= _run_case_in_process, args= (run, name, config, queue))
+    process.start()
+    status, result = queue.get()
+    process.join()
+    if status == "error": raise RuntimeError(f"Case {name} failed : {result}")
+    return result
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output= True, text= True, check= True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(cases, config):
+    results = {}
+    for name in cases:
+        # Best of the repeats, the least disturbed by the other processes of the machine
+        runs = [run_case_in_process(name, config) for _ in range(config["repeat"])]
+        results[name] = max(runs, key= lambda run : run["steps_per_second"])
+        print(f"{name:40} {results[name]['steps_per_second']:12,.0f} steps/s", file= sys.stderr)
+    return {
+        "date" : datetime.datetime.now().isoformat(timespec= "seconds"),
+        "commit" : git_commit(),
+        "platform" : platform.platform(),
+        "python" : platform.python_version(),
+        "versions" : {"numpy" : np.__version__, "pandas" : pd.__version__, "gymnasium" : gym.__version__},
+        "config" : config,
+        "results" : results,
+    }
+
+def compare(results, baseline, measures = ["steps_per_second", "reset_latency_median", "peak_memory_mb"]):
+    # Ratio of every measure to the baseline : > 1 means more steps per second, but slower resets and more memory
+    lines = []
+    for name, result in results["results"].items():
+        if name not in baseline["results"]: continue
+        ratios = []
+        for measure in measures:
+            value, baseline_value = result[measure], baseline["results"][name][measure]
+            if value is None or not baseline_value: continue
+            ratios.append(f"{measure} x{value / baseline_value:.2f}")
+        lines.append(f"{name:40} " + "   ".join(ratios))
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description= "Benchmark of the trading environments on synthetic data.")
+    parser.add_argument("--cases", nargs= "+", default= list(CASES.keys()), choices= list(CASES.keys()))
+    parser.add_argument("--length", type= int, default= 100_000, help= "Number of rows of the synthetic dataset.")
+    parser.add_argument("--nb-features", type= int, default= 4)
+    parser.add_argument("--steps", type= int, default= 20_000, help= "Number of steps of each case (shared by the environments of a vector environment).")
+    parser.add_argument("--resets", type= int, default= 100)
+    parser.add_argument("--num-envs", type= int, default= 4, help= "Number of environments of the vector environments.")
+    parser.add_argument("--nb-datasets", type= int, default= 4, help= "Number of datasets of MultiDatasetTradingEnv.")
+    parser.add_argument("--repeat", type= int, default= 1)
+    parser.add_argument("--seed", type= int, default= 0)
+    parser.add_argument("--output", help= "JSON file of the results. Default : printed.")
+    parser.add_argument("--compare", help= "JSON file of previous results to compare with.")
+    args = parser.parse_args()
+
+    config = {
+        "length" : args.length, "nb_features" : args.nb_features, "steps" : args.steps, "resets" : args.resets,
+        "num_envs" : args.num_envs, "nb_datasets" : args.nb_datasets, "repeat" : args.repeat, "seed" : args.seed,
+    }
+    results = run_benchmark(args.cases, config)
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent= 2)
+    else:
+        print(json.dumps(results, indent= 2))
+    if args.compare is not None:
+        with open(args.compare) as file:
+            print(compare(results, json.load(file)), file= sys.stderr)
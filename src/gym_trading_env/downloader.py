@@ -2,8 +2,17 @@ import asyncio
 import ccxt.async_support as ccxt
 import pandas as pd
 import datetime
+import json
 import numpy as np
 import nest_asyncio
+import os
+import random
+import shutil
+import tempfile
+from collections import deque
+from .utils.dataset_formats import get_dataset_format, read_dataset, partition_paths
+from .utils.rate_limiter import RateLimiter
+from .utils.ohlcv import resample_ohlcv, timeframe_ms, MS_PER_DAY
 nest_asyncio.apply()
 import sys 
 if sys.platform == 'win32':
@@ -27,6 +36,9 @@ EXCHANGE_LIMIT_RATES = {
     }
 }
 
+# Periods of the files of a partitioned dataset
+PARTITION_FREQUENCIES = {"day" : "D", "month" : "M", "year" : "Y"}
+
 async def _ohlcv(exchange, symbol, timeframe, limit, step_since, timedelta):
     result = await exchange.fetch_ohlcv(symbol = symbol, timeframe= timeframe, limit= limit, since=step_since)
     result_df = pd.DataFrame(result, columns=["timestamp_open", "open", "high", "low", "close", "volume"])
@@ -37,53 +49,319 @@ async def _ohlcv(exchange, symbol, timeframe, limit, step_since, timedelta):
 
     return result_df
 
-async def _download_symbol(exchange, symbol, timeframe = '5m', since = int(datetime.datetime(year=2020, month= 1, day= 1).timestamp()*1E3), until = int(datetime.datetime.now().timestamp()*1E3), limit = 1000, pause_every = 10, pause = 1):
-    timedelta = int(pd.Timedelta(timeframe).to_timedelta64()/1E6)
-    tasks = []
-    results = []
-    for step_since in range(since, until, limit * timedelta):
-        tasks.append(
-            asyncio.create_task(_ohlcv(exchange, symbol, timeframe, limit, step_since, timedelta))
-        )
-        if len(tasks) >= pause_every:
-            results.extend(await asyncio.gather(*tasks))
-            await asyncio.sleep(pause)
-            tasks = []
-    if len(tasks) > 0 :
-        results.extend(await asyncio.gather(*tasks))
-    final_df = pd.concat(results, ignore_index= True)
-    final_df = final_df.loc[(since < final_df["timestamp_open"]) & (final_df["timestamp_open"] < until), :]
-    del final_df["timestamp_open"]
-    final_df.set_index('date_open', drop=True, inplace=True)
+def _rate_limiter(exchange_name):
+    # The fixed pauses of EXCHANGE_LIMIT_RATES give the initial rate : "pause_every" requests every "pause" seconds
+    limit_rates = EXCHANGE_LIMIT_RATES[exchange_name]
+    return RateLimiter(
+        rate= limit_rates["pause_every"] / max(limit_rates["pause"], 1E-3),
+        burst= limit_rates["pause_every"],
+        max_concurrency= limit_rates.get("max_concurrency", min(limit_rates["pause_every"], 8)),
+        max_rate= limit_rates.get("max_rate", None),
+    )
+
+async def _fetch_ohlcv(exchange, limiter, symbol, timeframe, limit, step_since, timedelta, max_retries = 5, backoff = 1):
+    # Network errors, timeouts and rate limit errors are retried with an exponential backoff, other errors are raised
+    for attempt in range(max_retries + 1):
+        try:
+            return await limiter.run(_ohlcv, exchange, symbol, timeframe, limit, step_since, timedelta)
+        except ccxt.NetworkError as error:
+            if isinstance(error, ccxt.DDoSProtection): limiter.on_rate_limit() # RateLimitExceeded included
+            if attempt == max_retries: raise
+            await asyncio.sleep(backoff * 2**attempt * random.uniform(0.5, 1.5))
+
+def _clean_page(page, since, until):
+    # Candles strictly after since and before until, indexed by their open date
+    page = page.loc[(since < page["timestamp_open"]) & (page["timestamp_open"] < until), :]
+    page = page.drop(columns= ["timestamp_open"]).set_index('date_open', drop=True)
+    page = page.dropna()
+    return page[~page.index.duplicated(keep= "last")]
+
+async def _ohlcv_pages(exchange, symbol, timeframe, since, until, limit = 1000, limiter = None, max_retries = 5):
+    # Yields the cleaned pages in order. The limiter decides when the requests are sent, but only a few pages are requested ahead : the memory stays bounded
+    timedelta = timeframe_ms(timeframe)
+    if limiter is None: limiter = RateLimiter(rate= 1)
+    step_sinces = iter(range(since, until, limit * timedelta))
+    pending = deque()
+    try:
+        while True:
+            while len(pending) < 2 * limiter.max_concurrency:
+                step_since = next(step_sinces, None)
+                if step_since is None: break
+                pending.append(asyncio.ensure_future(_fetch_ohlcv(exchange, limiter, symbol, timeframe, limit, step_since, timedelta, max_retries= max_retries)))
+            if len(pending) == 0: return
+            yield _clean_page(await pending.popleft(), since, until)
+    finally:
+        for task in pending: task.cancel()
+
+async def _download_symbol(exchange, symbol, timeframe = '5m', since = int(datetime.datetime(year=2020, month= 1, day= 1).timestamp()*1E3), until = int(datetime.datetime.now().timestamp()*1E3), limit = 1000, limiter = None, max_retries = 5):
+    results = [page async for page in _ohlcv_pages(exchange, symbol, timeframe, since, until, limit= limit, limiter= limiter, max_retries= max_retries)]
+    final_df = pd.concat(results)
     final_df.sort_index(inplace= True)
     final_df.dropna(inplace=True)
     final_df.drop_duplicates(inplace=True)
     return final_df
 
-async def _download_symbols(exchange_name, symbols, dir, timeframe,  **kwargs):
-    exchange = getattr(ccxt, exchange_name)({ 'enableRateLimit': True })
-    for symbol in symbols:
+def _timestamps(index):
+    return index.values.astype("datetime64[ms]").astype(np.int64)
+
+def _subtract_ranges(ranges, removed_ranges):
+    # Parts of the sorted [start, stop) ranges outside the sorted removed_ranges
+    result, i = [], 0
+    for start, stop in ranges:
+        while i < len(removed_ranges) and removed_ranges[i][1] <= start: i += 1
+        j = i
+        while j < len(removed_ranges) and removed_ranges[j][0] < stop:
+            if start < removed_ranges[j][0]: result.append((start, removed_ranges[j][0]))
+            start = max(start, removed_ranges[j][1])
+            j += 1
+        if start < stop: result.append((start, stop))
+    return result
+
+def _intersect_ranges(ranges, other_ranges):
+    # Parts of the sorted [start, stop) ranges inside the sorted other_ranges
+    result, i = [], 0
+    for start, stop in ranges:
+        while i < len(other_ranges) and other_ranges[i][1] <= start: i += 1
+        j = i
+        while j < len(other_ranges) and other_ranges[j][0] < stop:
+            if max(start, other_ranges[j][0]) < min(stop, other_ranges[j][1]):
+                result.append((max(start, other_ranges[j][0]), min(stop, other_ranges[j][1])))
+            j += 1
+    return result
+
+def _missing_ranges(timestamps, since, until, timedelta, merge_distance = 0, empty_ranges = []):
+    # [start, stop) ranges of candles (in ms) between since and until that are not in the sorted timestamps :
+    # before the first candle, in the gaps and after the last candle (the last candle is fetched again, it may have been stored before its close).
+    # The holes of the exchange are permanent : the empty_ranges found by the previous downloads are not requested again.
+    # Ranges closer than merge_distance are merged : downloading again a few stored candles costs less than another request
+    if len(timestamps) == 0: return _subtract_ranges([(since, until)], empty_ranges)
+    head_ranges, ranges = [], []
+    if timestamps[0] - since > timedelta: head_ranges.append((since, int(min(timestamps[0], until))))
+    gaps = np.flatnonzero(np.diff(timestamps) > timedelta)
+    for gap_start, gap_stop in zip(timestamps[gaps] + timedelta, timestamps[gaps + 1]):
+        gap_start, gap_stop = max(gap_start, since), min(gap_stop, until)
+        if gap_start < gap_stop: ranges.append((int(gap_start), int(gap_stop)))
+    head_ranges, ranges = _subtract_ranges(head_ranges, empty_ranges), _subtract_ranges(ranges, empty_ranges)
+    if timestamps[-1] < until: ranges.append((int(max(timestamps[-1], since)), until))
+    merged_ranges = []
+    for start, stop in ranges:
+        if len(merged_ranges) > 0 and start - merged_ranges[-1][1] <= merge_distance:
+            merged_ranges[-1] = (merged_ranges[-1][0], stop)
+        else:
+            merged_ranges.append((start, stop))
+    return head_ranges + merged_ranges
+
+def _empty_ranges_path(path, partition = None):
+    # Hidden file next to the dataset (in the directory of a partitioned dataset) : it is ignored by partition_paths and by the usual globs (eg. 'data/*.pkl')
+    if partition is not None: return os.path.join(path, ".empty_ranges.json")
+    return os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.empty_ranges.json")
+
+def _read_empty_ranges(path):
+    # [start, stop) ranges (in ms) where the exchange had no candle
+    try:
+        with open(path) as file:
+            return [tuple(empty_range) for empty_range in json.load(file)]
+    except (FileNotFoundError, ValueError):
+        return []
+
+def _write_empty_ranges(path, timestamps, timedelta, empty_ranges, since, until):
+    # The ranges without stored candle (before the last one) are empty on the exchange if they were downloaded : between since and until, or found empty before
+    checked_ranges = []
+    for start, stop in sorted(list(empty_ranges) + [(since, until)]):
+        if len(checked_ranges) > 0 and start <= checked_ranges[-1][1]:
+            checked_ranges[-1] = (checked_ranges[-1][0], max(checked_ranges[-1][1], stop))
+        else:
+            checked_ranges.append((start, stop))
+    if len(timestamps) == 0:
+        holes = [(-2**63, 2**63 - 1)]
+    else:
+        gaps = np.flatnonzero(np.diff(timestamps) > timedelta)
+        holes = [(-2**63, int(timestamps[0]))] + [(int(start), int(stop)) for start, stop in zip(timestamps[gaps] + timedelta, timestamps[gaps + 1])]
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump([list(empty_range) for empty_range in _intersect_ranges(holes, checked_ranges)], file)
+    os.replace(tmp_path, path)
+
+async def _missing_pages(exchange, symbol, timestamps, timeframe, since, until, limit = 1000, limiter = None, max_retries = 5, empty_ranges = []):
+    # Yields the pages of the candles missing from the sorted timestamps
+    timedelta = timeframe_ms(timeframe)
+    for start, stop in _missing_ranges(timestamps, since, until, timedelta, merge_distance= limit * timedelta, empty_ranges= empty_ranges):
+        if len(timestamps) > 0 and stop <= timestamps[0]:
+            # Nothing before the first stored candle is often the listing date of the symbol : check the page just before it first
+            page = await _fetch_ohlcv(exchange, limiter, symbol, timeframe, limit, max(start, stop - limit * timedelta), timedelta, max_retries= max_retries)
+            if not ((since < page["timestamp_open"]) & (page["timestamp_open"] < stop)).any(): continue
+        # The pages keep the candles strictly after their since : like a full download, the candle opening at since is excluded
+        async for page in _ohlcv_pages(exchange, symbol, timeframe, since= since if start == since else start - 1, until= stop, limit= limit, limiter= limiter, max_retries= max_retries):
+            if len(page) > 0: yield page
+
+async def _update_symbol(exchange, symbol, stored_df, timeframe, since, until, **kwargs):
+    # Download only the candles missing from stored_df and merge them
+    results = [page async for page in _missing_pages(exchange, symbol, _timestamps(stored_df.index), timeframe, since, until, **kwargs)]
+    if len(results) == 0: return stored_df, 0
+    df = pd.concat([stored_df] + results)
+    df = df[~df.index.duplicated(keep= "last")].sort_index()
+    return df, len(df) - len(stored_df)
+
+class _PartitionWriter:
+    """Writes the pages received in order as one file per period (eg. 'month'), as soon as the period is complete."""
+    def __init__(self, directory, dataset_format, partition):
+        self.directory = directory
+        self.dataset_format = dataset_format
+        self.freq = PARTITION_FREQUENCIES[partition]
+        self.period = None
+        self.buffer = []
+        self.nb_new_rows = 0
+        self.written_paths = []
+    def add(self, page):
+        periods = page.index.to_period(self.freq)
+        starts = np.concatenate([[0], np.flatnonzero(periods[1:] != periods[:-1]) + 1, [len(page)]])
+        for start, stop in zip(starts[:-1], starts[1:]):
+            if periods[start] != self.period:
+                self.flush()
+                self.period = periods[start]
+            self.buffer.append(page.iloc[start:stop])
+    def flush(self):
+        if len(self.buffer) == 0: return
+        df = pd.concat(self.buffer)
+        self.buffer = []
+        path = os.path.join(self.directory, f"{self.period}{self.dataset_format.extensions[0]}")
+        nb_stored_rows = 0
+        if os.path.exists(path):
+            # The candles at the boundaries of the downloaded ranges are merged with the stored ones
+            stored_df = self.dataset_format.read(path, None)
+            nb_stored_rows = len(stored_df)
+            df = pd.concat([stored_df, df])
+        df = df[~df.index.duplicated(keep= "last")].sort_index()
+        _write_atomic(self.dataset_format, df, path)
+        self.nb_new_rows += len(df) - nb_stored_rows
+        self.written_paths.append(path)
+
+def _partition_timestamps(directory):
+    # Only the index (and one column) of the stored partitions is read
+    try:
+        paths = partition_paths(directory)
+    except FileNotFoundError:
+        return np.zeros(shape= (0, ), dtype= np.int64)
+    return np.sort(np.concatenate([_timestamps(read_dataset(path, columns= ["close"]).index) for path in paths]))
+
+async def _download_partitioned_symbol(exchange, symbol, directory, dataset_format, partition, overwrite, timeframe, since, until, **kwargs):
+    # The stored partitions are kept unless overwrite : only the missing candles are downloaded, so an interrupted download resumes
+    if overwrite: shutil.rmtree(directory, ignore_errors= True)
+    os.makedirs(directory, exist_ok= True)
+    empty_ranges_path = _empty_ranges_path(directory, partition)
+    empty_ranges = _read_empty_ranges(empty_ranges_path)
+    writer = _PartitionWriter(directory, dataset_format, partition)
+    async for page in _missing_pages(exchange, symbol, _partition_timestamps(directory), timeframe, since, until, empty_ranges= empty_ranges, **kwargs):
+        writer.add(page)
+    writer.flush()
+    _write_empty_ranges(empty_ranges_path, _partition_timestamps(directory), timeframe_ms(timeframe), empty_ranges, since, until)
+    return writer.nb_new_rows, writer.written_paths
+
+def _derive_partitions(directory, derived_directory, dataset_format, timeframe, source_timeframe, written_paths, overwrite):
+    # Resample the partitions written by this download, and those missing from derived_directory (the bars never cross a partition boundary).
+    # The incomplete last bar of the last partition is dropped : the partition is written again (and the bar derived) once the next candles are downloaded
+    if overwrite: shutil.rmtree(derived_directory, ignore_errors= True)
+    os.makedirs(derived_directory, exist_ok= True)
+    paths = partition_paths(directory)
+    for i, path in enumerate(paths):
+        derived_path = os.path.join(derived_directory, os.path.basename(path))
+        if path not in written_paths and os.path.exists(derived_path): continue
+        df = resample_ohlcv(dataset_format.read(path, None), timeframe, drop_incomplete_first= i == 0, drop_incomplete_last= i == len(paths) - 1, source_timeframe= source_timeframe)
+        _write_atomic(dataset_format, df, derived_path)
+
+def _write_atomic(dataset_format, df, path):
+    # Write in a temporary file, then move it : the stored file is never left partially written
+    fd, tmp_path = tempfile.mkstemp(dir= os.path.dirname(os.path.abspath(path)), prefix= ".tmp_", suffix= dataset_format.extensions[0])
+    os.close(fd)
+    try:
+        dataset_format.write(df, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+        raise
+
+async def _download_and_store_symbol(exchange, exchange_name, symbol, dir, timeframe, dataset_format, update, partition = None, derived_timeframes = [], overwrite = False, **kwargs):
+    # Only timeframe is downloaded, the derived timeframes are resampled from it
+    name = f"{dir}/{exchange_name}-{symbol.replace('/', '')}"
+    if partition is not None:
+        directory = f"{name}-{timeframe}"
+        nb_new_rows, written_paths = await _download_partitioned_symbol(exchange, symbol, directory, dataset_format, partition, overwrite, timeframe= timeframe, **kwargs)
+        print(f"{symbol} {'updated' if update else 'downloaded'} from {exchange_name} ({nb_new_rows} new candles) and stored in {directory}")
+        for derived_timeframe in derived_timeframes:
+            _derive_partitions(directory, f"{name}-{derived_timeframe}", dataset_format, derived_timeframe, timeframe, written_paths, overwrite)
+            print(f"{symbol} {derived_timeframe} derived from {timeframe} and stored in {name}-{derived_timeframe}")
+        return
+    save_file = f"{name}-{timeframe}{dataset_format.extensions[0]}"
+    empty_ranges_path = _empty_ranges_path(save_file)
+    if update and os.path.exists(save_file):
+        empty_ranges = _read_empty_ranges(empty_ranges_path)
+        df, nb_new_rows = await _update_symbol(exchange = exchange, symbol = symbol, stored_df = dataset_format.read(save_file, None), timeframe= timeframe, empty_ranges= empty_ranges, **kwargs)
+        print(f"{symbol} updated from {exchange_name} ({nb_new_rows} new candles) and stored at {save_file}")
+    else:
+        empty_ranges = []
         df = await _download_symbol(exchange = exchange, symbol = symbol, timeframe= timeframe, **kwargs)
-        save_file = f"{dir}/{exchange_name}-{symbol.replace('/', '')}-{timeframe}.pkl"
         print(f"{symbol} downloaded from {exchange_name} and stored at {save_file}")
-        df.to_pickle(save_file)
-    await exchange.close()
+    _write_atomic(dataset_format, df, save_file)
+    _write_empty_ranges(empty_ranges_path, _timestamps(df.index), timeframe_ms(timeframe), empty_ranges, kwargs["since"], kwargs["until"])
+    for derived_timeframe in derived_timeframes:
+        derived_save_file = f"{name}-{derived_timeframe}{dataset_format.extensions[0]}"
+        # Derived again from every candle : the incomplete last bar dropped by a previous download is added once complete
+        _write_atomic(dataset_format, resample_ohlcv(df, derived_timeframe, source_timeframe= timeframe), derived_save_file)
+        print(f"{symbol} {derived_timeframe} derived from {timeframe} and stored at {derived_save_file}")
+
+def _split_timeframes(timeframes, partition = None):
+    # The finest timeframe is downloaded, the others are derived from it
+    if isinstance(timeframes, str): return timeframes, []
+    timeframes = sorted(set(timeframes), key= timeframe_ms)
+    finest = timeframes[0]
+    for timeframe in timeframes[1:]:
+        if timeframe_ms(timeframe) % timeframe_ms(finest) != 0:
+            raise ValueError(f"The timeframe {timeframe} is not a multiple of the finest timeframe {finest} : it can not be derived from it.")
+        if partition is not None and MS_PER_DAY % timeframe_ms(timeframe) != 0:
+            raise ValueError(f"With partitions, the derived timeframes must divide a day (the bars can not cross partitions) : {timeframe} does not.")
+    return finest, timeframes[1:]
+
+def _ccxt_exchange(exchange_name):
+    # ccxt's own fixed throttling is disabled : the rate limiter replaces it
+    return getattr(ccxt, exchange_name)({ 'enableRateLimit': False })
+
+async def _download_symbols(exchange_name, symbols, dir, timeframe, format = "pickle", update = False, exchange_factory = _ccxt_exchange, **kwargs):
+    # The requests of every symbol share the rate limiter of the exchange
+    exchange = exchange_factory(exchange_name)
+    dataset_format = get_dataset_format(format = format)
+    limiter = _rate_limiter(exchange_name)
+    try:
+        results = await asyncio.gather(*[
+            _download_and_store_symbol(exchange, exchange_name, symbol, dir, timeframe, dataset_format, update, limiter = limiter, **kwargs)
+            for symbol in symbols
+        ], return_exceptions= True)
+    finally:
+        await exchange.close()
+    # A symbol that failed (after its retries) does not stop the others
+    errors = {symbol : result for symbol, result in zip(symbols, results) if isinstance(result, BaseException)}
+    for symbol, error in errors.items():
+        print(f"{symbol} could not be downloaded from {exchange_name} : {type(error).__name__} {error}")
+    return {(exchange_name, symbol) : error for symbol, error in errors.items()}
 
-async def _download(exchange_names, symbols, timeframe, dir, since : datetime.datetime, until : datetime.datetime = datetime.datetime.now()):
+async def _download(exchange_names, symbols, timeframe, dir, since : datetime.datetime, until : datetime.datetime = datetime.datetime.now(), format = "pickle", update = False, partition = None, overwrite = False, max_retries = 5, exchange_factory = _ccxt_exchange):
+    if update and overwrite: raise ValueError("The 'update' and 'overwrite' parameters can not be both True.")
+    timeframe, derived_timeframes = _split_timeframes(timeframe, partition)
     tasks = []
     for exchange_name in exchange_names:
         
         limit = EXCHANGE_LIMIT_RATES[exchange_name]["limit"]
-        pause_every = EXCHANGE_LIMIT_RATES[exchange_name]["pause_every"]
-        pause = EXCHANGE_LIMIT_RATES[exchange_name]["pause"]
         tasks.append(
             _download_symbols(
-                exchange_name = exchange_name, symbols= symbols, timeframe= timeframe, dir = dir,
-                limit = limit, pause_every = pause_every, pause = pause,
+                exchange_name = exchange_name, symbols= symbols, timeframe= timeframe, dir = dir, format = format, update = update, partition = partition, derived_timeframes = derived_timeframes, overwrite = overwrite,
+                limit = limit, max_retries = max_retries, exchange_factory = exchange_factory,
                 since = int(since.timestamp()*1E3), until = int(until.timestamp()*1E3)
             )
         )
-    await asyncio.gather(*tasks)
+    errors = {}
+    for exchange_errors in await asyncio.gather(*tasks):
+        errors.update(exchange_errors)
+    if len(errors) > 0:
+        raise RuntimeError(f"{len(errors)} download(s) failed (the other datasets were stored) : {', '.join(f'{symbol} from {exchange_name}' for exchange_name, symbol in errors)}")
 def download(*args, **kwargs):
     # loop = asyncio.get_event_loop()
     asyncio.run(
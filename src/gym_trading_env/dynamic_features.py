@@ -0,0 +1,45 @@
+from .utils.incremental import IncrementalFunction
+
+class LastPosition(IncrementalFunction):
+    """The last position taken by the agent."""
+    def reset(self, valuation, position, real_position, price):
+        return self.update(valuation, position, real_position, price)
+    def update(self, valuation, position, real_position, price):
+        self.value = position
+        return self.value
+
+class RealPosition(IncrementalFunction):
+    """The real position of the portfolio (that varies according to the price fluctuations)."""
+    def reset(self, valuation, position, real_position, price):
+        return self.update(valuation, position, real_position, price)
+    def update(self, valuation, position, real_position, price):
+        self.value = real_position
+        return self.value
+
+class UnrealizedPnL(IncrementalFunction):
+    """The unrealized profit (or loss) of the current position, relative to the portfolio : ``position * (price / entry price - 1)``. The entry price is the close price of the step where the position was taken."""
+    def reset(self, valuation, position, real_position, price):
+        self._position, self._entry_price, self._last_price = position, price, price
+        self.value = 0.
+        return self.value
+    def update(self, valuation, position, real_position, price):
+        if position != self._position:
+            # Market orders are executed at the price of the previous step
+            self._position, self._entry_price = position, self._last_price
+        self._last_price = price
+        self.value = position * (price / self._entry_price - 1)
+        return self.value
+
+class TimeInPosition(IncrementalFunction):
+    """The number of steps since the last position change."""
+    def reset(self, valuation, position, real_position, price):
+        self._position = position
+        self.value = 0
+        return self.value
+    def update(self, valuation, position, real_position, price):
+        if position != self._position:
+            self._position = position
+            self.value = 0
+        else:
+            self.value += 1
+        return self.value
@@ -7,13 +7,35 @@ import glob
 from pathlib import Path    
 
 from collections import Counter
+import copy
 from .utils.history import History
-from .utils.portfolio import Portfolio, TargetPortfolio
+from .utils.incremental import IncrementalFunction
+from .rewards import LogReturn
+from .dynamic_features import LastPosition, RealPosition
+from .metrics import Metric, MarketReturn, PortfolioReturn
+from .utils.portfolio import Portfolio, TargetPortfolio, BatchPortfolio
+from .utils.order_book import LimitOrderBook, GOOD_TILL_CANCELLED
+from .utils.dataset_cache import DatasetCache
+from .utils.disk_cache import DiskDatasetCache
+from .utils.dataset_store import DatasetStore
+from .utils.dataset_formats import read_dataset
+from .utils.profiler import StepProfiler
 
 import tempfile, os
 import warnings
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import cloudpickle
+from collections import deque
 warnings.filterwarnings("error")
 
+RECORD_MINIMAL_COLUMNS = ["idx", "step", "date", "position_index", "position", "real_position", "portfolio_valuation", "reward"]
+PORTFOLIO_DISTRIBUTION_KEYS = ["asset", "fiat", "borrowed_asset", "borrowed_fiat", "interest_asset", "interest_fiat"]
+
+def _is_user_function(function):
+    # Functions (and incremental functions) defined outside of this package : their time is the user time of the profile
+    module = str(getattr(function, "__module__", ""))
+    return module != __package__ and not module.startswith(f"{__package__}.")
+
 def basic_reward_function(history : History):
     return np.log(history["portfolio_valuation", -1] / history["portfolio_valuation", -2])
 
@@ -23,6 +45,10 @@ def dynamic_feature_last_position_taken(history):
 def dynamic_feature_real_position(history):
     return history['real_position', -1]
 
+def _read_and_preprocess(dataset_path, pickled_preprocess, columns, format):
+    # Runs in the worker processes of MultiDatasetTradingEnv : preprocess is pickled with cloudpickle as it is often a lambda
+    return cloudpickle.loads(pickled_preprocess)(read_dataset(dataset_path, columns= columns, format= format))
+
 class TradingEnv(gym.Env):
     """
     An easy trading environment for OpenAI gym. It is recommended to use it this way :
@@ -35,7 +61,9 @@ class TradingEnv(gym.Env):
 
 
     :param df: The market DataFrame. It must contain 'open', 'high', 'low', 'close'. Index must be DatetimeIndex. Your desired inputs need to contain 'feature' in their column name : this way, they will be returned as observation at each step.
-    :type df: pandas.DataFrame
+        It can also be a ``gym_trading_env.utils.dataset_store.DatasetStore`` : the environment then reads the memory-mapped arrays of the store instead of holding its own copy of the dataset.
+        For datasets larger than the memory, use a ``gym_trading_env.utils.chunked_dataset.ChunkedDataset`` : only the chunks used by the episode are loaded.
+    :type df: pandas.DataFrame, DatasetStore or ChunkedDataset
 
     :param positions: List of the positions allowed by the environment.
     :type positions: optional - list[int or float]
@@ -45,14 +73,22 @@ class TradingEnv(gym.Env):
         * the last position taken by the agent.
         * the real position of the portfolio (that varies according to the price fluctuations)
 
+        It can contain functions taking the History object, or built-in dynamic features from ``gym_trading_env.dynamic_features`` that are updated incrementally.
+
     :type dynamic_feature_functions: optional - list   
 
-    :param reward_function: Take the History object of the environment and must return a float.
-    :type reward_function: optional - function<History->float>
+    :param reward_function: Take the History object of the environment and must return a float. You can also use a built-in reward from ``gym_trading_env.rewards`` (default is ``LogReturn()``).
+    :type reward_function: optional - function<History->float> or IncrementalFunction
 
     :param windows: Default is None. If it is set to an int: N, every step observation will return the past N observations. It is recommended for Recurrent Neural Network based Agents.
     :type windows: optional - None or int
 
+    :param observation_mode: Default is 'copy' : each observation is a new array. With 'view' (only when ``windows`` is used), the observation is a read-only view on the internal observation array, which avoids a copy at every step. It stays valid until the next ``reset()``.
+    :type observation_mode: optional - 'copy' or 'view'
+
+    :param observation_buffer: Default is None. If you provide a preallocated array with the shape of the observation space, every observation is written into it and this array is returned (instead of allocating a new one).
+    :type observation_buffer: optional - numpy.ndarray
+
     :param trading_fees: Transaction trading fees (buy and sell operations). eg: 0.01 corresponds to 1% fees
     :type trading_fees: optional - float
 
@@ -68,6 +104,22 @@ class TradingEnv(gym.Env):
     :param max_episode_duration: If a integer value is used, each episode will be truncated after reaching the desired max duration in steps (by returning `truncated` as `True`). When using a max duration, each episode will start at a random starting point.
     :type max_episode_duration: optional - int or 'max'
 
+    :param record: Controls what is stored in the History and returned as ``info`` at each step :
+
+        * ``'full'`` (default) : every column (DataFrame info and portfolio distribution included). ``info`` is a dictionary.
+        * ``'minimal'`` : only the columns used by the environment (``idx``, ``step``, ``date``, ``position_index``, ``position``, ``real_position``, ``portfolio_valuation``, ``reward``). ``info`` is a lazy read-only view on the History.
+        * ``'none'`` : same History as ``'minimal'``, but ``info`` is an empty dictionary.
+        * a list of columns to record in addition to the minimal ones (eg. ``['data_close', 'portfolio_distribution']``). ``info`` is a lazy read-only view on the History.
+
+    :type record: optional - str or list
+
+    :param history_size: Default is None : the History holds every step of the episode. If it is set to an int K, only the last K steps are kept (ring buffer), which bounds the memory of very long episodes.
+        The reward function, the dynamic features and the metrics computed from the History then only see these K steps.
+    :type history_size: optional - int
+
+    :param profile: If True, the environment measures the time spent in every phase of ``reset`` and ``step`` (see ``get_profile``). Default is False : nothing is measured.
+    :type profile: optional - bool
+
     :param verbose: If 0, no log is outputted. If 1, the env send episode result logs.
     :type verbose: optional - int
     
@@ -76,17 +128,23 @@ class TradingEnv(gym.Env):
     
     """
     metadata = {'render_modes': ['logs']}
+    _history_dtypes = {"idx": np.int64, "step": np.int64, "position_index": np.int64}
     def __init__(self,
                 df : pd.DataFrame,
                 positions : list = [0, 1],
-                dynamic_feature_functions = [dynamic_feature_last_position_taken, dynamic_feature_real_position],
-                reward_function = basic_reward_function,
+                dynamic_feature_functions = [LastPosition(), RealPosition()],
+                reward_function = LogReturn(),
                 windows = None,
+                observation_mode = "copy",
+                observation_buffer = None,
                 trading_fees = 0,
                 borrow_interest_rate = 0,
                 portfolio_initial_value = 1000,
                 initial_position ='random',
                 max_episode_duration = 'max',
+                record = "full",
+                history_size = None,
+                profile = False,
                 verbose = 1,
                 name = "Stock",
                 render_mode= "logs"
@@ -96,14 +154,30 @@ class TradingEnv(gym.Env):
         self.verbose = verbose
 
         self.positions = positions
-        self.dynamic_feature_functions = dynamic_feature_functions
-        self.reward_function = reward_function
+        # Built-in functions hold a running state : each environment needs its own copy
+        self.dynamic_feature_functions = [copy.deepcopy(function) if isinstance(function, IncrementalFunction) else function for function in dynamic_feature_functions]
+        self.reward_function = copy.deepcopy(reward_function) if isinstance(reward_function, IncrementalFunction) else reward_function
+        # Dynamic features updated at each step (IncrementalFunction) or computed from the History, split between the functions of the package and the user's ones
+        self._incremental_features = [(i, function) for i, function in enumerate(self.dynamic_feature_functions) if isinstance(function, IncrementalFunction)]
+        self._env_incremental_features = [function for _, function in self._incremental_features if not _is_user_function(function)]
+        self._user_incremental_features = [function for _, function in self._incremental_features if _is_user_function(function)]
+        self._env_history_features = [(i, function) for i, function in enumerate(self.dynamic_feature_functions) if not isinstance(function, IncrementalFunction) and not _is_user_function(function)]
+        self._user_history_features = [(i, function) for i, function in enumerate(self.dynamic_feature_functions) if not isinstance(function, IncrementalFunction) and _is_user_function(function)]
+        self._reward_phase = "reward" if _is_user_function(self.reward_function) else "history"
         self.windows = windows
+        self.observation_mode = observation_mode
+        self.observation_buffer = observation_buffer
         self.trading_fees = trading_fees
         self.borrow_interest_rate = borrow_interest_rate
         self.portfolio_initial_value = float(portfolio_initial_value)
         self.initial_position = initial_position
         assert self.initial_position in self.positions or self.initial_position == 'random', "The 'initial_position' parameter must be 'random' or a position mentionned in the 'position' (default is [0, 1]) parameter."
+        assert self.observation_mode in ["copy", "view"], "The 'observation_mode' parameter must be 'copy' or 'view'."
+        self.record = record
+        self.history_size = history_size
+        assert self.history_size is None or self.history_size >= 2, "The 'history_size' parameter must be None or an int >= 2."
+        self._profiler = StepProfiler() if profile else None
+        assert isinstance(self.record, list) or self.record in ["full", "minimal", "none"], "The 'record' parameter must be 'full', 'minimal', 'none' or a list of columns."
         assert render_mode is None or render_mode in self.metadata["render_modes"]
         self.max_episode_duration = max_episode_duration
         self.render_mode = render_mode
@@ -121,60 +195,229 @@ class TradingEnv(gym.Env):
                 np.inf,
                 shape = [self.windows, self._nb_features]
             )
+        if self.observation_buffer is not None:
+            assert tuple(self.observation_buffer.shape) == self.observation_space.shape, f"The 'observation_buffer' must have the shape of the observations : {self.observation_space.shape}"
         
         self.log_metrics = []
+        self._metric_accumulators = []
+        self.add_metric("Market Return", MarketReturn())
+        self.add_metric("Portfolio Return", PortfolioReturn())
 
 
     def _set_df(self, df):
+        self._set_dataset(self._prepare_dataset(df))
+
+    def _prepare_dataset(self, df):
+        # Everything the environment needs from a DataFrame (the DataFrame, its arrays and column metadata), as a dict of attributes
+        if isinstance(df, DatasetStore): return self._prepare_dataset_store(df)
         df = df.copy()
-        self._features_columns = [col for col in df.columns if "feature" in col]
-        self._info_columns = list(set(list(df.columns) + ["close"]) - set(self._features_columns))
-        self._nb_features = len(self._features_columns)
-        self._nb_static_features = self._nb_features
+        features_columns = [col for col in df.columns if "feature" in col]
+        info_columns = list(set(list(df.columns) + ["close"]) - set(features_columns))
+        nb_static_features = len(features_columns)
 
         for i  in range(len(self.dynamic_feature_functions)):
             df[f"dynamic_feature__{i}"] = 0
-            self._features_columns.append(f"dynamic_feature__{i}")
-            self._nb_features += 1
+            features_columns.append(f"dynamic_feature__{i}")
 
-        self.df = df
-        self._obs_array = np.array(self.df[self._features_columns], dtype= np.float32)
-        self._info_array = np.array(self.df[self._info_columns])
-        self._price_array = np.array(self.df["close"])
+        return {
+            "df" : df,
+            "_features_columns" : features_columns,
+            "_info_columns" : info_columns,
+            "_nb_features" : len(features_columns),
+            "_nb_static_features" : nb_static_features,
+            "_obs_array" : np.array(df[features_columns], dtype= np.float32),
+            "_info_array" : np.array(df[info_columns]),
+            "_price_array" : np.array(df["close"]),
+            "_high_array" : np.array(df["high"], dtype= np.float64) if "high" in df else None,
+            "_low_array" : np.array(df["low"], dtype= np.float64) if "low" in df else None,
+            "_dates" : df.index.values,
+        }
 
+    def _prepare_dataset_store(self, store):
+        # Same attributes, but the arrays are the read-only memory-mapped arrays of the store.
+        # _obs_array only holds the static features : the dynamic features are written in a private buffer (see _get_obs)
+        features_columns = list(store.features_columns) + [f"dynamic_feature__{i}" for i in range(len(self.dynamic_feature_functions))]
+        return {
+            "df" : store,
+            "_features_columns" : features_columns,
+            "_info_columns" : list(store.info_columns),
+            "_nb_features" : len(features_columns),
+            "_nb_static_features" : len(store.features_columns),
+            "_obs_array" : store.features,
+            "_info_array" : store.info,
+            "_price_array" : store.column("close"),
+            "_high_array" : store.column("high") if "high" in store else None,
+            "_low_array" : store.column("low") if "low" in store else None,
+            "_dates" : store.dates,
+        }
+
+    def _set_dataset(self, dataset):
+        self._dataset_attributes = list(dataset.keys())
+        for attribute, value in dataset.items():
+            setattr(self, attribute, value)
+        self._set_record_columns()
+        self._dynamic_obs = None
+        if isinstance(self.df, DatasetStore):
+            assert self.observation_mode == "copy", "The 'observation_mode' parameter must be 'copy' when using a DatasetStore."
+            # Dynamic features of the last 'windows' steps, the oldest first
+            self._dynamic_obs = np.zeros(shape= (1 if self.windows is None else self.windows, self._nb_features - self._nb_static_features), dtype= np.float32)
+        elif self.windows is not None:
+            # Read-only views of shape (windows, nb_features) on _obs_array : the dynamic features written in _obs_array are visible through them
+            self._obs_windows = np.lib.stride_tricks.sliding_window_view(self._obs_array, self.windows, axis = 0).transpose(0, 2, 1)
+
+    def _set_record_columns(self):
+        # Columns of the DataFrame info (data_*) and of the portfolio distribution (portfolio_distribution_*) stored in the History
+        if self.record == "full":
+            info_columns, distribution_keys = list(self._info_columns), list(PORTFOLIO_DISTRIBUTION_KEYS)
+        elif not isinstance(self.record, list):
+            info_columns, distribution_keys = [], []
+        else:
+            info_columns = [col for col in self._info_columns if "data" in self.record or f"data_{col}" in self.record]
+            distribution_keys = [key for key in PORTFOLIO_DISTRIBUTION_KEYS if "portfolio_distribution" in self.record or f"portfolio_distribution_{key}" in self.record]
+            known_columns = set(RECORD_MINIMAL_COLUMNS + ["data", "portfolio_distribution"] + [f"data_{col}" for col in self._info_columns] + [f"portfolio_distribution_{key}" for key in PORTFOLIO_DISTRIBUTION_KEYS])
+            unknown_columns = [column for column in self.record if column not in known_columns]
+            if len(unknown_columns) > 0:
+                raise ValueError(f"Columns {unknown_columns} can not be recorded ... Check the available columns : {sorted(known_columns)}")
+        self._record_info_columns = info_columns
+        self._record_info_indexes = np.array([self._info_columns.index(col) for col in info_columns], dtype= np.int64)
+        self._record_all_info = info_columns == self._info_columns
+        self._record_distribution_keys = distribution_keys
+
+    def _history_record(self, idx, step, position_index, position, real_position, portfolio_valuation, portfolio_distribution):
+        # Arguments of History.set/add/extend : idx can be an int (one step) or an array (several steps).
+        # portfolio_distribution is a function returning the distribution, only called if it is recorded.
+        record = dict(
+            idx = idx,
+            step = step,
+            date = self._dates[idx],
+            position_index = position_index,
+            position = position,
+            real_position = real_position,
+        )
+        several_steps = isinstance(idx, np.ndarray)
+        if len(self._record_info_columns) > 0:
+            if several_steps:
+                record["data"] = {column : self._info_array[idx, i] for column, i in zip(self._record_info_columns, self._record_info_indexes)}
+            elif self._record_all_info:
+                record["data"] = dict(zip(self._info_columns, self._info_array[idx]))
+            else:
+                record["data"] = dict(zip(self._record_info_columns, self._info_array[idx, self._record_info_indexes]))
+        record["portfolio_valuation"] = portfolio_valuation
+        if len(self._record_distribution_keys) > 0:
+            distribution = portfolio_distribution()
+            if len(self._record_distribution_keys) < len(PORTFOLIO_DISTRIBUTION_KEYS):
+                distribution = {key : distribution[key] for key in self._record_distribution_keys}
+            record["portfolio_distribution"] = distribution
+        record["reward"] = np.zeros(len(idx)) if several_steps else 0
+        return record
+
+    def _history_size(self):
+        # An episode can not be longer than the dataset, nor than max_episode_duration
+        if isinstance(self.max_episode_duration, int): return min(len(self._price_array), self.max_episode_duration)
+        return len(self._price_array)
+
+    def _new_history(self, ring):
+        # The History of the previous episode is reused (without reallocating its arrays) when it has the right size
+        size = self.history_size if ring else self._history_size()
+        history = getattr(self, "historical_info", None)
+        if history is None or history.height != size or history.ring != ring:
+            history = History(max_size= size, dtypes= self._history_dtypes, ring= ring)
+        return history
+
+    def _choose_start_idx(self):
+        idx = 0
+        if self.windows is not None: idx = self.windows - 1
+        if self.max_episode_duration != 'max':
+            idx = np.random.randint(
+                low = idx, 
+                high = len(self._price_array) - self.max_episode_duration - idx
+            )
+        return idx
+
+    def _episode_last_idx(self, start_idx):
+        # Last index an episode starting at start_idx can reach
+        return len(self._price_array) - 1
+
+    def _get_info(self, t):
+        if self.record == "full": return self.historical_info[t]
+        if self.record == "none": return {}
+        return self.historical_info.row(t)
 
-    
     def _get_ticker(self, delta = 0):
+        if isinstance(self.df, DatasetStore): return self.df.row(self._idx + delta)
         return self.df.iloc[self._idx + delta]
     def _get_price(self, delta = 0):
         return self._price_array[self._idx + delta]
     
     def _get_obs(self):
-        for i, dynamic_feature_function in enumerate(self.dynamic_feature_functions):
+        if self._dynamic_obs is not None: return self._get_store_obs()
+        for i, dynamic_feature_function in self._user_history_features:
+            self._obs_array[self._idx, self._nb_static_features + i] = dynamic_feature_function(self.historical_info)
+        if self._profiler is not None and len(self._user_history_features) > 0: self._profiler.lap("dynamic_features")
+        for i, dynamic_feature_function in self._incremental_features:
+            self._obs_array[self._idx, self._nb_static_features + i] = dynamic_feature_function.value
+        for i, dynamic_feature_function in self._env_history_features:
             self._obs_array[self._idx, self._nb_static_features + i] = dynamic_feature_function(self.historical_info)
 
         if self.windows is None:
-            _step_index = self._idx
-        else: 
-            _step_index = np.arange(self._idx + 1 - self.windows , self._idx + 1)
-        return self._obs_array[_step_index]
+            obs = self._obs_array[self._idx]
+        elif self.observation_mode == "view":
+            obs = self._obs_windows[self._idx + 1 - self.windows]
+        else:
+            obs = self._obs_array[self._idx + 1 - self.windows : self._idx + 1]
+            if self.observation_buffer is None: obs = obs.copy()
+
+        if self.observation_buffer is not None:
+            np.copyto(self.observation_buffer, obs)
+            obs = self.observation_buffer
+        if self._profiler is not None: self._profiler.lap("observation")
+        return obs
+
+    def _get_store_obs(self):
+        # The static features come from the shared (read-only) _obs_array, the dynamic features from the private _dynamic_obs buffer
+        shift = min(self._idx - self._dynamic_obs_idx, len(self._dynamic_obs))
+        if shift > 0:
+            self._dynamic_obs[:-shift] = self._dynamic_obs[shift:]
+            self._dynamic_obs[-shift:] = 0
+        self._dynamic_obs_idx = self._idx
+        for i, dynamic_feature_function in self._user_history_features:
+            self._dynamic_obs[-1, i] = dynamic_feature_function(self.historical_info)
+        if self._profiler is not None and len(self._user_history_features) > 0: self._profiler.lap("dynamic_features")
+        for i, dynamic_feature_function in self._incremental_features:
+            self._dynamic_obs[-1, i] = dynamic_feature_function.value
+        for i, dynamic_feature_function in self._env_history_features:
+            self._dynamic_obs[-1, i] = dynamic_feature_function(self.historical_info)
 
+        obs = self.observation_buffer
+        if obs is None: obs = np.empty(shape= self.observation_space.shape, dtype= np.float32)
+        if self.windows is None:
+            obs[:self._nb_static_features] = self._obs_array[self._idx]
+            obs[self._nb_static_features:] = self._dynamic_obs[-1]
+        else:
+            obs[:, :self._nb_static_features] = self._obs_array[self._idx + 1 - self.windows : self._idx + 1]
+            obs[:, self._nb_static_features:] = self._dynamic_obs
+        if self._profiler is not None: self._profiler.lap("observation")
+        return obs
     
     def reset(self, seed = None, options=None, **kwargs):
         super().reset(seed = seed, options = options, **kwargs)
+        profiler = self._profiler
+        if profiler is not None:
+            profiler.resets += 1
+            profiler.start()
         
+        self._episode_index = getattr(self, "_episode_index", 0) + 1
         self._step = 0
         self._position = np.random.choice(self.positions) if self.initial_position == 'random' else self.initial_position
-        self._limit_orders = {}
+        self._limit_orders = LimitOrderBook()
         
 
-        self._idx = 0
-        if self.windows is not None: self._idx = self.windows - 1
-        if self.max_episode_duration != 'max':
-            self._idx = np.random.randint(
-                low = self._idx, 
-                high = len(self.df) - self.max_episode_duration - self._idx
-            )
+        self._idx = self._choose_start_idx()
+        self._last_idx = self._episode_last_idx(self._idx)
+        if self._dynamic_obs is not None:
+            # The dynamic features of the steps preceding the start of the episode are 0
+            self._dynamic_obs[:] = 0
+            self._dynamic_obs_idx = self._idx
         
         self._portfolio  = TargetPortfolio(
             position = self._position,
@@ -182,32 +425,37 @@ class TradingEnv(gym.Env):
             price = self._get_price()
         )
         
-        self.historical_info = History(max_size= len(self.df))
-        self.historical_info.set(
+        self.historical_info = self._new_history(ring= self.history_size is not None)
+        self.historical_info.set(**self._history_record(
             idx = self._idx,
             step = self._step,
-            date = self.df.index.values[self._idx],
             position_index =self.positions.index(self._position),
             position = self._position,
             real_position = self._position,
-            data =  dict(zip(self._info_columns, self._info_array[self._idx])),
             portfolio_valuation = self.portfolio_initial_value,
-            portfolio_distribution = self._portfolio.get_portfolio_distribution(),
-            reward = 0,
-        )
+            portfolio_distribution = self._portfolio.get_portfolio_distribution,
+        ))
+        for function in self.dynamic_feature_functions + [self.reward_function]:
+            if isinstance(function, IncrementalFunction):
+                function.reset(self.portfolio_initial_value, self._position, self._position, self._get_price())
+        for metric in self._metric_accumulators:
+            metric.reset(self.portfolio_initial_value, self._position, self._position, self._get_price())
+        if profiler is not None: profiler.lap("reset")
 
-        return self._get_obs(), self.historical_info[0]
+        return self._get_obs(), self._get_info(0)
 
     def render(self):
         pass
 
     def _trade(self, position, price = None):
-        self._portfolio.trade_to_position(
+        traded_value, fees = self._portfolio.trade_to_position(
             position, 
             price = self._get_price() if price is None else price, 
             trading_fees = self.trading_fees
         )
         self._position = position
+        for metric in self._metric_accumulators:
+            metric.on_trade(traded_value, fees)
         return
 
     def _take_action(self, position):
@@ -216,92 +464,347 @@ class TradingEnv(gym.Env):
     
     def _take_action_order_limit(self):
         if len(self._limit_orders) > 0:
-            ticker = self._get_ticker()
-            for position, params in self._limit_orders.items():
-                if position != self._position and params['limit'] <= ticker["high"] and params['limit'] >= ticker["low"]:
-                    self._trade(position, price= params['limit'])
-                    if not params['persistent']: del self._limit_orders[position]
+            self._limit_orders.expire(self._idx)
+            for slot in self._limit_orders.triggered(low = self._low_array[self._idx], high = self._high_array[self._idx]):
+                position = self._limit_orders.positions[slot]
+                if position != self._position:
+                    self._trade(position, price= self._limit_orders.limits[slot])
+                    if not self._limit_orders.persistent[slot]: self._limit_orders.remove(slot)
 
 
     
-    def add_limit_order(self, position, limit, persistent = False):
-        self._limit_orders[position] = {
-            'limit' : limit,
-            'persistent': persistent
-        }
+    def add_limit_order(self, position, limit, persistent = False, duration = None, replace = True):
+        """
+        Add a limit order : the environment will trade to ``position`` as soon as the price reaches ``limit``.
+
+        :param persistent: If True, the order stays pending after being executed.
+        :param duration: Number of steps during which the order is valid. Default is None : the order is valid until it is executed or cancelled.
+        :param replace: If True (default), the new order replaces the pending order with the same position. Use False to have several orders for one position.
+        :return: The id of the order, to be used with ``cancel_limit_order``.
+        """
+        assert self._high_array is not None and self._low_array is not None, "Your DataFrame needs to contain columns : high, low to use limit orders !"
+        return self._limit_orders.add(
+            position = position,
+            limit = limit,
+            persistent = persistent,
+            expiry = GOOD_TILL_CANCELLED if duration is None else self._idx + duration,
+            replace = replace
+        )
+
+    def cancel_limit_order(self, order_id):
+        return self._limit_orders.cancel(order_id)
     
     def step(self, position_index = None):
+        profiler = self._profiler
+        if profiler is not None:
+            profiler.steps += 1
+            profiler.start()
         if position_index is not None: self._take_action(self.positions[position_index])
         self._idx += 1
         self._step += 1
+        if profiler is not None: profiler.lap("action")
 
         self._take_action_order_limit()
+        if profiler is not None: profiler.lap("limit_orders")
         price = self._get_price()
         self._portfolio.update_interest(borrow_interest_rate= self.borrow_interest_rate)
+        if profiler is not None: profiler.lap("interest")
         portfolio_value = self._portfolio.valorisation(price)
-        portfolio_distribution = self._portfolio.get_portfolio_distribution()
+        real_position = self._portfolio.real_position(price)
+        if profiler is not None: profiler.lap("valuation")
 
         done, truncated = False, False
 
         if portfolio_value <= 0:
             done = True
-        if self._idx >= len(self.df) - 1:
+        if self._idx >= self._last_idx:
             truncated = True
         if isinstance(self.max_episode_duration,int) and self._step >= self.max_episode_duration - 1:
             truncated = True
 
-        self.historical_info.add(
+        self.historical_info.add(**self._history_record(
             idx = self._idx,
             step = self._step,
-            date = self.df.index.values[self._idx],
             position_index =position_index,
             position = self._position,
-            real_position = self._portfolio.real_position(price),
-            data =  dict(zip(self._info_columns, self._info_array[self._idx])),
+            real_position = real_position,
             portfolio_valuation = portfolio_value,
-            portfolio_distribution = portfolio_distribution, 
-            reward = 0
-        )
+            portfolio_distribution = self._portfolio.get_portfolio_distribution,
+        ))
+        # The built-in dynamic features are timed with the History, the user's ones with dynamic_features
+        for dynamic_feature_function in self._env_incremental_features:
+            dynamic_feature_function.update(portfolio_value, self._position, real_position, price)
+        if profiler is not None: profiler.lap("history")
+        for dynamic_feature_function in self._user_incremental_features:
+            dynamic_feature_function.update(portfolio_value, self._position, real_position, price)
+        if profiler is not None and len(self._user_incremental_features) > 0: profiler.lap("dynamic_features")
+        for metric in self._metric_accumulators:
+            metric.update(portfolio_value, self._position, real_position, price)
+        if profiler is not None: profiler.lap("metrics")
+        reward = 0
         if not done:
-            reward = self.reward_function(self.historical_info)
+            if isinstance(self.reward_function, IncrementalFunction):
+                reward = self.reward_function.update(portfolio_value, self._position, real_position, price)
+            else:
+                reward = self.reward_function(self.historical_info)
+            if profiler is not None: profiler.lap(self._reward_phase)
             self.historical_info["reward", -1] = reward
+        if profiler is not None: profiler.lap("history")
 
         if done or truncated:
             self.calculate_metrics()
             self.log()
-        return self._get_obs(),  self.historical_info["reward", -1], done, truncated, self.historical_info[-1]
+            if profiler is not None: profiler.lap("episode_end")
+        return self._get_obs(), reward, done, truncated, self._get_info(-1)
+
+    def snapshot(self):
+        """
+        Capture the state of the current episode, to come back to it later with ``restore``. It is useful for planning algorithms (eg. MCTS) that explore several actions from the same state.
+        Only the small mutable state is captured (indexes, position, portfolio, pending limit orders, state of the built-in functions and metrics and size of the History) : the dataset and the History are not copied
+        (except the last ``history_size`` steps when the History is a ring buffer).
+
+        :return: An opaque object to give to ``restore``. It is valid until the next ``reset()``.
+        """
+        return {
+            "episode_index" : self._episode_index,
+            "idx" : self._idx,
+            "step" : self._step,
+            "last_idx" : self._last_idx,
+            "position" : self._position,
+            "portfolio" : copy.copy(self._portfolio),
+            "limit_orders" : self._limit_orders.copy() if len(self._limit_orders) > 0 else None,
+            "history" : self.historical_info.get_state(),
+            "functions" : [function.get_state() for function in self.dynamic_feature_functions + [self.reward_function] if isinstance(function, IncrementalFunction)],
+            "metrics" : [metric.get_state() for metric in self._metric_accumulators],
+            "dynamic_obs" : None if self._dynamic_obs is None else (self._dynamic_obs.copy(), self._dynamic_obs_idx),
+        }
+
+    def restore(self, snapshot):
+        """
+        Come back to the state captured by ``snapshot()`` (it can be restored several times). The steps taken since the snapshot are removed from the History.
+        """
+        if snapshot["episode_index"] != self._episode_index: raise ValueError("This snapshot was taken during another episode.")
+        self._idx, self._step, self._last_idx, self._position = snapshot["idx"], snapshot["step"], snapshot["last_idx"], snapshot["position"]
+        self._portfolio = copy.copy(snapshot["portfolio"])
+        self._limit_orders = LimitOrderBook() if snapshot["limit_orders"] is None else snapshot["limit_orders"].copy()
+        self.historical_info.set_state(snapshot["history"])
+        for function, state in zip([function for function in self.dynamic_feature_functions + [self.reward_function] if isinstance(function, IncrementalFunction)], snapshot["functions"]):
+            function.set_state(state)
+        for metric, state in zip(self._metric_accumulators, snapshot["metrics"]):
+            metric.set_state(state)
+        if snapshot["dynamic_obs"] is not None:
+            self._dynamic_obs[:], self._dynamic_obs_idx = snapshot["dynamic_obs"]
+
+    def _valuations(self, asset, fiat, prices):
+        # Valuation of the portfolio and interests for arrays of states and prices (same operations as Portfolio.valorisation)
+        interest_asset = np.maximum(0, -asset) * self.borrow_interest_rate
+        interest_fiat = np.maximum(0, -fiat) * self.borrow_interest_rate
+        return asset * prices + fiat + (- interest_asset * prices) + (- interest_fiat), interest_asset, interest_fiat
+
+    def backtest(self, position_indexes, start_idx = None, initial_position = None):
+        """
+        Run a whole episode from an array of actions (position indexes) without stepping through the environment.
+        It produces the same History as a ``reset()`` followed by a ``step()`` loop, but the valuation curve is computed with numpy :
+        the portfolio only changes when the position changes, so only the trades are computed one by one.
+        Pending limit orders are not taken into account.
+
+        :param position_indexes: The action taken at every step.
+        :type position_indexes: list or numpy.ndarray of int
+
+        :param start_idx: Index of the DataFrame where the episode starts. Default is the first possible index.
+        :type start_idx: optional - int
+
+        :param initial_position: Position at the start of the episode. Default is the ``initial_position`` of the environment.
+        :type initial_position: optional - float or int
+
+        :return: The History of the episode (also stored in ``env.historical_info``, ready for ``save_for_render``).
+        """
+        self._episode_index = getattr(self, "_episode_index", 0) + 1
+        self._step = 0
+        self._limit_orders = LimitOrderBook()
+        self._idx = (0 if self.windows is None else self.windows - 1) if start_idx is None else start_idx
+        if initial_position is None:
+            initial_position = np.random.choice(self.positions) if self.initial_position == 'random' else self.initial_position
+        self._position = initial_position
+        start = self._idx
+        self._last_idx = self._episode_last_idx(start)
+
+        # Cut the actions where the episode would end because of truncation
+        position_indexes = np.asarray(position_indexes, dtype= np.int64)
+        nb_steps = min(len(position_indexes), self._episode_last_idx(start) - start)
+        if isinstance(self.max_episode_duration, int): nb_steps = min(nb_steps, self.max_episode_duration - 1)
+        position_indexes = position_indexes[:nb_steps]
+        positions = np.array(self.positions)[position_indexes]
+        idxs = np.arange(start + 1, start + nb_steps + 1)
+
+        # Trades (only when the position changes) : sequential, but computed only once per trade
+        self._portfolio = TargetPortfolio(position = self._position, value = self.portfolio_initial_value, price = self._get_price())
+        initial_portfolio_distribution = self._portfolio.get_portfolio_distribution()
+        trades = positions != np.concatenate([[self._position], positions[:-1]])
+        trade_steps = np.flatnonzero(trades)
+        assets, fiats = np.empty(len(trade_steps) + 1), np.empty(len(trade_steps) + 1)
+        traded_values, fees = np.zeros(nb_steps + 1), np.zeros(nb_steps + 1)
+        assets[0], fiats[0] = self._portfolio.asset, self._portfolio.fiat
+        for i, t in enumerate(trade_steps):
+            # The episode ends at the first step where the portfolio is ruined : the trades after it never happen (and may overflow)
+            previous_t = trade_steps[i - 1] if i > 0 else 0
+            if np.any(self._valuations(assets[i], fiats[i], self._price_array[idxs[previous_t:t]])[0] <= 0):
+                nb_steps = t
+                position_indexes, positions, idxs, trades = position_indexes[:nb_steps], positions[:nb_steps], idxs[:nb_steps], trades[:nb_steps]
+                break
+            # Between two trades, update_interest always gives the same interests : apply it once
+            if t > 0: self._portfolio.update_interest(borrow_interest_rate= self.borrow_interest_rate)
+            traded_values[t + 1], fees[t + 1] = self._portfolio.trade_to_position(positions[t], price = self._price_array[start + t], trading_fees = self.trading_fees)
+            assets[i + 1], fiats[i + 1] = self._portfolio.asset, self._portfolio.fiat
+
+        # Valuation of the portfolio at every step
+        state_indexes = np.cumsum(trades)
+        asset, fiat = assets[state_indexes], fiats[state_indexes]
+        prices = self._price_array[idxs]
+        portfolio_valuation, interest_asset, interest_fiat = self._valuations(asset, fiat, prices)
+
+        # Stop at the first step where the portfolio is ruined
+        ruined = np.flatnonzero(portfolio_valuation <= 0)
+        if len(ruined) > 0:
+            nb_steps = ruined[0] + 1
+            position_indexes, positions, idxs, prices = position_indexes[:nb_steps], positions[:nb_steps], idxs[:nb_steps], prices[:nb_steps]
+            asset, fiat, interest_asset, interest_fiat = asset[:nb_steps], fiat[:nb_steps], interest_asset[:nb_steps], interest_fiat[:nb_steps]
+            portfolio_valuation = portfolio_valuation[:nb_steps]
+        with np.errstate(divide= "ignore", invalid= "ignore"):
+            real_position = (asset - interest_asset) * prices / portfolio_valuation
+
+        # A new History (it is returned) holding the whole episode (needed to compute the rewards)
+        self.historical_info = History(max_size= self._history_size(), dtypes= self._history_dtypes)
+        self.historical_info.set(**self._history_record(
+            idx = self._idx,
+            step = self._step,
+            position_index =self.positions.index(self._position),
+            position = self._position,
+            real_position = self._position,
+            portfolio_valuation = self.portfolio_initial_value,
+            portfolio_distribution = lambda : initial_portfolio_distribution,
+        ))
+        self.historical_info.extend(**self._history_record(
+            idx = idxs,
+            step = np.arange(1, nb_steps + 1),
+            position_index = position_indexes,
+            position = positions,
+            real_position = real_position,
+            portfolio_valuation = portfolio_valuation,
+            portfolio_distribution = lambda : {
+                "asset":np.maximum(0, asset),
+                "fiat":np.maximum(0, fiat),
+                "borrowed_asset":np.maximum(0, -asset),
+                "borrowed_fiat":np.maximum(0, -fiat),
+                "interest_asset":interest_asset,
+                "interest_fiat":interest_fiat,
+            },
+        ))
+
+        # Rewards
+        done = len(ruined) > 0
+        nb_rewards = nb_steps - 1 if done else nb_steps
+        if self.reward_function is basic_reward_function or type(self.reward_function) is LogReturn:
+            valuations = self.historical_info["portfolio_valuation"]
+            self.historical_info["reward", 1:nb_rewards + 1] = np.log(valuations[1:nb_rewards + 1] / valuations[:nb_rewards])
+        elif isinstance(self.reward_function, IncrementalFunction):
+            valuations, real_positions = self.historical_info["portfolio_valuation"], self.historical_info["real_position"]
+            self.reward_function.reset(valuations[0], self.historical_info["position", 0], real_positions[0], self._price_array[start])
+            rewards = [
+                self.reward_function.update(valuations[t], positions[t - 1], real_positions[t], self._price_array[start + t])
+                for t in range(1, nb_rewards + 1)
+            ]
+            self.historical_info["reward", 1:nb_rewards + 1] = rewards
+        else:
+            size = self.historical_info.size
+            for t in range(1, nb_rewards + 1):
+                self.historical_info.size = t + 1
+                self.historical_info["reward", -1] = self.reward_function(self.historical_info)
+            self.historical_info.size = size
+
+        # Leave the environment in the state reached at the end of the episode
+        self._step = nb_steps
+        self._idx = start + nb_steps
+        if nb_steps > 0: self._position = positions[-1]
+        self._portfolio.update_interest(borrow_interest_rate= self.borrow_interest_rate)
+        history = self.historical_info
+        trades = np.concatenate([[False], trades[:nb_steps]])
+        self.calculate_metrics(accumulator_results= [
+            metric.compute(history["portfolio_valuation"], history["position"], history["real_position"], self._price_array[history["idx"]], trades, traded_values[:nb_steps + 1], fees[:nb_steps + 1])
+            for metric in self._metric_accumulators
+        ])
+        self.log()
+        return self.historical_info
 
     def add_metric(self, name, function):
+        """
+        Add a metric to the episode results.
+
+        :param name: The displayed name of the metric.
+        :param function: A function that takes the History object at the end of the episode, or a built-in metric from ``gym_trading_env.metrics`` that is updated at every step.
+            A built-in metric added during an episode only measures the rest of this episode (from the current step), and the whole following episodes.
+        """
+        if isinstance(function, Metric):
+            function = copy.deepcopy(function)
+            self._metric_accumulators.append(function)
+            # During an episode, the metric starts from the current state (reset() resets the metrics at the start of the next ones)
+            if hasattr(self, "_portfolio"):
+                price = self._get_price()
+                function.reset(self._portfolio.valorisation(price), self._position, self._portfolio.real_position(price), price)
         self.log_metrics.append({
             'name': name,
             'function': function
         })
-    def calculate_metrics(self):
-        self.results_metrics = {
-            "Market Return" : f"{100*(self.historical_info['data_close', -1] / self.historical_info['data_close', 0] -1):5.2f}%",
-            "Portfolio Return" : f"{100*(self.historical_info['portfolio_valuation', -1] / self.historical_info['portfolio_valuation', 0] -1):5.2f}%",
-        }
-
+    def calculate_metrics(self, accumulator_results = None):
+        # accumulator_results : results of the built-in metrics when they were not updated step by step (eg. backtest)
+        if accumulator_results is None: accumulator_results = [metric.result() for metric in self._metric_accumulators]
+        accumulator_results = dict(zip(map(id, self._metric_accumulators), accumulator_results))
+        self.results_metrics = {}
         for metric in self.log_metrics:
-            self.results_metrics[metric['name']] = metric['function'](self.historical_info)
+            if isinstance(metric['function'], Metric):
+                self.results_metrics[metric['name']] = accumulator_results[id(metric['function'])]
+            else:
+                self.results_metrics[metric['name']] = metric['function'](self.historical_info)
     def get_metrics(self):
         return self.results_metrics
+
+    def get_profile(self):
+        """
+        Time spent in every phase of ``reset`` and ``step`` since the creation of the environment (or the last ``reset_profile``). The environment must be created with ``profile = True``.
+
+        :return: A dictionary : ``phases`` maps every phase to its cumulative ``time`` (in seconds) and number of ``calls``, ``steps`` and ``resets`` count the calls of ``step`` and ``reset``,
+            ``user_time`` is the time spent in the reward function and the dynamic features, ``env_time`` the time spent in the environment itself and ``total_time`` their sum.
+            None if the environment does not profile.
+        :rtype: dict
+        """
+        if self._profiler is None: return None
+        return self._profiler.stats()
+
+    def reset_profile(self):
+        if self._profiler is not None: self._profiler.clear()
     def log(self):
         if self.verbose > 0:
             text = ""
-            for key, value in self.results_metrics.items():
-                text += f"{key} : {value}   |   "
+            for metric in self.log_metrics:
+                value = self.results_metrics[metric['name']]
+                if isinstance(metric['function'], Metric): value = metric['function'].formatted(value)
+                text += f"{metric['name']} : {value}   |   "
             print(text)
 
     def save_for_render(self, dir = "render_logs"):
-        assert "open" in self.df and "high" in self.df and "low" in self.df and "close" in self.df, "Your DataFrame needs to contain columns : open, high, low, close to render !"
+        # Only the rows of the episode : the concatenated datasets of MultiDatasetTradingEnv (dataset_sampling 'uniform' or 'length')
+        # can have the same dates, the rows of the other datasets must not be joined with the History
+        idx = self.historical_info["idx"]
+        start, stop = int(idx.min()), int(idx.max()) + 1
+        df = self.df.to_dataframe(start= start, stop= stop) if isinstance(self.df, DatasetStore) else self.df.iloc[start:stop]
+        assert "open" in df and "high" in df and "low" in df and "close" in df, "Your DataFrame needs to contain columns : open, high, low, close to render !"
         columns = list(set(self.historical_info.columns) - set([f"date_{col}" for col in self._info_columns]))
         history_df = pd.DataFrame(
-            self.historical_info[columns], columns= columns
+            {column : self.historical_info[column] for column in columns}
         )
         history_df.set_index("date", inplace= True)
         history_df.sort_index(inplace = True)
-        render_df = self.df.join(history_df, how = "inner")
+        render_df = df.join(history_df, how = "inner")
         
         if not os.path.exists(dir):os.makedirs(dir)
         render_df.to_pickle(f"{dir}/{self.name}_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.pkl")
@@ -327,8 +830,16 @@ class MultiDatasetTradingEnv(TradingEnv):
     
     
     :param dataset_dir: A `glob path <https://docs.python.org/3.6/library/glob.html>`_ that needs to match your datasets. All of your datasets needs to match the dataset requirements (see docs from TradingEnv). If it is not the case, you can use the ``preprocess`` param to make your datasets match the requirements.
+        The datasets can be pickle (``.pkl``), Parquet (``.parquet``), Feather (``.feather``) or compressed numpy (``.npz``) files : the format is found from the file extension.
+        A directory matched by ``dataset_dir`` is read as a partitioned dataset (eg. written by the downloader with ``partition = 'month'``) : its files are concatenated.
     :type dataset_dir: str
 
+    :param dataset_columns: Columns to load from each dataset, before ``preprocess``. Default is None : every column. With Parquet, Feather and NPZ files, the other columns are not read at all.
+    :type dataset_columns: optional - list[str]
+
+    :param dataset_format: Format of the datasets ('pickle', 'parquet', 'feather', 'npz' or a format added with ``gym_trading_env.utils.dataset_formats.register_dataset_format``). Default is None : the format is found from the file extension.
+    :type dataset_format: optional - str
+
     :param preprocess: This function takes a pandas.DataFrame and returns a pandas.DataFrame. This function is applied to each dataset before being used in the environment.
         
         For example, imagine you have a folder named 'data' with several datasets (formatted as .pkl)
@@ -361,24 +872,95 @@ class MultiDatasetTradingEnv(TradingEnv):
 
     :param episodes_between_dataset_switch: Number of times a dataset is used to create an episode, before moving on to another dataset. It can be useful for performances when `max_episode_duration` is low.
     :type episodes_between_dataset_switch: optional - int
+
+    :param dataset_sampling: How the dataset of an episode is chosen :
+
+        * ``'switch'`` (default) : one dataset is used at a time, the environment switches to another one every ``episodes_between_dataset_switch`` episodes.
+        * ``'uniform'`` : every dataset is loaded at startup in one concatenated array. Each episode is drawn from any dataset, chosen uniformly, without any switching cost.
+        * ``'length'`` : same as ``'uniform'``, but the datasets are chosen proportionally to their number of possible episode starts (to their length when ``max_episode_duration = 'max'``) : every step of every dataset has the same chance to start an episode.
+
+        With ``'uniform'`` and ``'length'``, episodes and observation windows never overlap two datasets.
+    :type dataset_sampling: optional - str
+
+    :param dataset_cache_size: Number of prepared datasets (preprocessed DataFrame and its arrays) kept in memory, so that using a dataset again does not require to load and preprocess it. 0 (default) disables the cache, None means no limit.
+    :type dataset_cache_size: optional - int or None
+
+    :param dataset_cache_max_bytes: Maximum memory used by the cached datasets. The least recently used datasets are removed first.
+    :type dataset_cache_max_bytes: optional - int
+
+    :param dataset_disk_cache_dir: Default is None. If set, the preprocessed datasets are stored in this directory and reused by the next environments (including other processes), as long as the dataset file, the code of ``preprocess`` (with the values and helper functions it uses) and ``dataset_cache_version`` do not change.
+    :type dataset_disk_cache_dir: optional - str
+
+    :param dataset_cache_version: Default is None. Version of the preprocessing, part of the key of the datasets of ``dataset_disk_cache_dir`` and ``dataset_store_dir``. Change it to invalidate them when something ``preprocess`` depends on changes without being part of its fingerprint (eg. the code of an imported module or a file it reads).
+    :type dataset_cache_version: optional - str or int
+
+    :param dataset_store_dir: Default is None. If set, each preprocessed dataset is written once in this directory as a ``DatasetStore`` and the environment reads its memory-mapped arrays.
+        Environments running in different processes (eg. ``gym.make_vec(..., vectorization_mode = "async")``) with the same directory share the memory of the datasets instead of holding one copy each.
+        Like ``dataset_disk_cache_dir``, a stored dataset is reused as long as the dataset file, the code of ``preprocess`` and ``dataset_cache_version`` do not change.
+    :type dataset_store_dir: optional - str
+
+    :param preload: Default is False. If True, every dataset is loaded, preprocessed and checked at startup : all the datasets must have the same features, otherwise a ValueError is raised.
+        The preprocessed datasets are kept in the stores of ``dataset_store_dir``, in ``dataset_disk_cache_dir`` and in the in-memory cache (``dataset_cache_size``) when they are used.
+        Without any of them, each preprocessed dataset is kept in memory until its first use only : use ``dataset_cache_size = None`` to keep every dataset ready for the following uses.
+    :type preload: optional - bool
+
+    :param preload_workers: Number of processes used to preprocess the datasets with ``preload`` (it also applies to the loading of every dataset by the ``'uniform'`` and ``'length'`` ``dataset_sampling``). Default is None : one per CPU core. Use 1 to preprocess them one after another in the current process.
+    :type preload_workers: optional - int
+
+    :param prefetch: Number of upcoming datasets loaded and preprocessed in advance by a background thread while the current episodes run, so that switching dataset in ``reset()`` does not wait. 0 (default) disables prefetching. Errors raised while loading a dataset are raised by the ``reset()`` that uses it.
+    :type prefetch: optional - int
     """
     def __init__(self,
                 dataset_dir, 
                 *args, 
 
                 preprocess = lambda df : df,
+                dataset_columns = None,
+                dataset_format = None,
                 episodes_between_dataset_switch = 1,
+                dataset_sampling = "switch",
+                dataset_cache_size = 0,
+                dataset_cache_max_bytes = None,
+                prefetch = 0,
+                dataset_disk_cache_dir = None,
+                dataset_store_dir = None,
+                dataset_cache_version = None,
+                preload = False,
+                preload_workers = None,
                 **kwargs):
         self.dataset_dir = dataset_dir
         self.preprocess = preprocess
+        self.dataset_columns = dataset_columns
+        self.dataset_format = dataset_format
         self.episodes_between_dataset_switch = episodes_between_dataset_switch
+        self.dataset_sampling = dataset_sampling
+        assert self.dataset_sampling in ["switch", "uniform", "length"], "The 'dataset_sampling' parameter must be 'switch', 'uniform' or 'length'."
+        self.dataset_disk_cache = DiskDatasetCache(dataset_disk_cache_dir, cache_version= dataset_cache_version) if dataset_disk_cache_dir is not None else None
+        # The stores are identified (and invalidated) like the entries of the disk cache
+        self.dataset_store_keys = DiskDatasetCache(dataset_store_dir, cache_version= dataset_cache_version) if dataset_store_dir is not None else None
+        self.dataset_cache = DatasetCache(max_entries= dataset_cache_size, max_bytes= dataset_cache_max_bytes) if dataset_cache_size != 0 else None
         self.dataset_pathes = glob.glob(self.dataset_dir)
         if len(self.dataset_pathes) == 0:raise FileNotFoundError(f"No dataset found with the path : {self.dataset_dir}")
         self.dataset_nb_uses = np.zeros(shape=(len(self.dataset_pathes), ))
-        super().__init__(self.next_dataset(), *args, **kwargs)
+        self.preload = preload
+        self.preload_workers = os.cpu_count() if preload_workers is None else preload_workers
+        self._preloaded = {}
+        if self.preload and self.dataset_sampling == "switch": self._preload_datasets()
+        if self.dataset_sampling == "switch":
+            super().__init__(self.next_dataset(), *args, **kwargs)
+            if self.dataset_cache is not None: self.dataset_cache.put(self._dataset_path, self._get_dataset())
+            for dataset_path in list(self._preloaded.keys()) if self.dataset_cache is not None else []:
+                self.dataset_cache.put(dataset_path, self._prepare_dataset(self._preloaded.pop(dataset_path)))
+        else:
+            super().__init__(self._load_concatenated_dataset(), *args, **kwargs)
+            self._set_segment_starts()
 
-    def next_dataset(self):
-        self._episodes_on_this_dataset = 0
+        self.prefetch = prefetch
+        self._prefetch_queue = deque()
+        self._prefetch_executor = ThreadPoolExecutor(max_workers= 1, thread_name_prefix= "dataset_prefetch") if self.prefetch > 0 and self.dataset_sampling == "switch" else None
+        self._fill_prefetch_queue()
+
+    def _choose_dataset_path(self):
         # Find the indexes of the less explored dataset
         potential_dataset_pathes = np.where(self.dataset_nb_uses == self.dataset_nb_uses.min())[0]
         # Pick one of them
@@ -386,16 +968,369 @@ class MultiDatasetTradingEnv(TradingEnv):
         dataset_idx = potential_dataset_pathes[ random_int ]
         dataset_path = self.dataset_pathes[dataset_idx]
         self.dataset_nb_uses[dataset_idx] += 1 # Update nb use counts
+        return dataset_path
 
+    def _use_dataset_path(self, dataset_path):
+        self._episodes_on_this_dataset = 0
+        self._dataset_path = dataset_path
         self.name = Path(dataset_path).name
-        return self.preprocess(pd.read_pickle(dataset_path))
+        return dataset_path
+
+    def _next_dataset_path(self):
+        return self._use_dataset_path(self._choose_dataset_path())
+
+    def _fill_prefetch_queue(self):
+        # The next datasets are chosen in advance and prepared in the background (unless they are already cached)
+        while self._prefetch_executor is not None and len(self._prefetch_queue) < self.prefetch:
+            dataset_path = self._choose_dataset_path()
+            future = None
+            if self.dataset_cache is None or dataset_path not in self.dataset_cache:
+                future = self._prefetch_executor.submit(lambda path : self._prepare_dataset(self._load_dataset(path)), dataset_path)
+            self._prefetch_queue.append((dataset_path, future))
+
+    def _load_dataset(self, dataset_path):
+        if self.dataset_store_keys is not None:
+            return self._load_dataset_store(dataset_path)
+        return self._load_dataframe(dataset_path)
+
+    def _dataset_store_directory(self, dataset_path):
+        return os.path.join(self.dataset_store_keys.cache_dir, self.dataset_store_keys.key(dataset_path, self.preprocess, self.dataset_columns))
+
+    def _load_dataset_store(self, dataset_path, df = None):
+        directory = self._dataset_store_directory(dataset_path)
+        if not DatasetStore.exists(directory):
+            DatasetStore.create(directory, self._load_dataframe(dataset_path) if df is None else df, metadata= self.dataset_store_keys.source_metadata(dataset_path))
+            self.dataset_store_keys.remove_outdated(dataset_path)
+        return DatasetStore(directory)
+
+    def _load_dataframe(self, dataset_path):
+        if dataset_path in self._preloaded: return self._preloaded.pop(dataset_path)
+        if self.dataset_disk_cache is None:
+            return self.preprocess(self._read_dataset(dataset_path))
+        df = self.dataset_disk_cache.get(dataset_path, self.preprocess, self.dataset_columns)
+        if df is None:
+            df = self.preprocess(self._read_dataset(dataset_path))
+            self.dataset_disk_cache.put(dataset_path, self.preprocess, df, self.dataset_columns)
+        return df
+
+    def _read_dataset(self, dataset_path):
+        return read_dataset(dataset_path, columns= self.dataset_columns, format= self.dataset_format)
+
+    def next_dataset(self):
+        return self._load_dataset(self._next_dataset_path())
+
+    def _load_concatenated_dataset(self):
+        # Every dataset in one DataFrame (or DatasetStore) : the dataset i covers the indexes from _segment_bounds[i] to _segment_bounds[i+1]
+        if self.dataset_store_keys is not None:
+            directory = os.path.join(self.dataset_store_keys.cache_dir, self.dataset_store_keys.group_key(self.dataset_pathes, self.preprocess, self.dataset_columns))
+            if not DatasetStore.exists(directory):
+                df, segment_bounds = self._concatenate(self.dataset_pathes)
+                DatasetStore.create(directory, df, metadata= {"segment_bounds" : segment_bounds.tolist()})
+            store = DatasetStore(directory)
+            self._segment_bounds = np.array(store.metadata["segment_bounds"], dtype= np.int64)
+            return store
+        df, self._segment_bounds = self._concatenate(self.dataset_pathes)
+        return df
+
+    def _concatenate(self, dataset_pathes):
+        dfs = list(self._load_dataframes(dataset_pathes).values())
+        return pd.concat(dfs), np.concatenate([[0], np.cumsum([len(df) for df in dfs])]).astype(np.int64)
+
+    def _check_features(self, dataset_path, columns, reference):
+        # reference : [features of the first checked dataset] (filled by the first call)
+        features_columns = [col for col in columns if "feature" in col]
+        if len(reference) == 0: reference.append(features_columns)
+        elif features_columns != reference[0]:
+            raise ValueError(f"Every dataset must have the same features. {dataset_path} has the features {features_columns} instead of {reference[0]}")
+
+    def _load_dataframes(self, dataset_pathes, reference = None):
+        # Load and preprocess several datasets (in a process pool with preload and preload_workers > 1), checking that they have the same features
+        reference = [] if reference is None else reference
+        dfs = {}
+        if not self.preload or self.preload_workers <= 1 or len(dataset_pathes) <= 1:
+            for dataset_path in dataset_pathes:
+                dfs[dataset_path] = self._load_dataframe(dataset_path)
+                self._check_features(dataset_path, dfs[dataset_path].columns, reference)
+            return dfs
+        futures = {}
+        with ProcessPoolExecutor(max_workers= min(self.preload_workers, len(dataset_pathes))) as executor:
+            try:
+                pickled_preprocess = cloudpickle.dumps(self.preprocess)
+                for dataset_path in dataset_pathes:
+                    df = self.dataset_disk_cache.get(dataset_path, self.preprocess, self.dataset_columns) if self.dataset_disk_cache is not None else None
+                    if df is not None:
+                        dfs[dataset_path] = df
+                        self._check_features(dataset_path, df.columns, reference)
+                        continue
+                    futures[executor.submit(_read_and_preprocess, dataset_path, pickled_preprocess, self.dataset_columns, self.dataset_format)] = dataset_path
+                for future in as_completed(futures):
+                    dataset_path = futures[future]
+                    dfs[dataset_path] = future.result()
+                    self._check_features(dataset_path, dfs[dataset_path].columns, reference)
+                    if self.dataset_disk_cache is not None: self.dataset_disk_cache.put(dataset_path, self.preprocess, dfs[dataset_path], self.dataset_columns)
+            except BaseException:
+                # Fail fast : the datasets not started yet are not processed
+                for future in futures: future.cancel()
+                raise
+        return {dataset_path : dfs[dataset_path] for dataset_path in dataset_pathes}
+
+    def _preload_datasets(self):
+        reference = []
+        dataset_pathes = self.dataset_pathes
+        if self.dataset_store_keys is not None:
+            # The datasets already stored are only checked
+            stored = [dataset_path for dataset_path in dataset_pathes if DatasetStore.exists(self._dataset_store_directory(dataset_path))]
+            for dataset_path in stored:
+                self._check_features(dataset_path, DatasetStore(self._dataset_store_directory(dataset_path)).columns, reference)
+            dataset_pathes = [dataset_path for dataset_path in dataset_pathes if dataset_path not in stored]
+        for dataset_path, df in self._load_dataframes(dataset_pathes, reference).items():
+            if self.dataset_store_keys is not None: self._load_dataset_store(dataset_path, df)
+            # Without a store nor a disk cache, the preprocessed datasets are kept in memory until they are used
+            elif self.dataset_cache is not None or self.dataset_disk_cache is None: self._preloaded[dataset_path] = df
+
+    def _set_segment_starts(self):
+        # Range of the possible episode starts in each dataset (same rule as TradingEnv, applied to each dataset)
+        offset = 0 if self.windows is None else self.windows - 1
+        self._segment_low = self._segment_bounds[:-1] + offset
+        if self.max_episode_duration == 'max':
+            self._segment_high = self._segment_low + 1
+        else:
+            self._segment_high = self._segment_bounds[1:] - self.max_episode_duration - offset
+        nb_starts = np.maximum(self._segment_high - self._segment_low, 0)
+        if nb_starts.sum() == 0: raise ValueError("No dataset is long enough for the 'windows' and 'max_episode_duration' parameters.")
+        if self.dataset_sampling == "uniform": weights = nb_starts > 0
+        elif self.max_episode_duration == 'max': weights = (nb_starts > 0) * np.diff(self._segment_bounds) # Whole datasets : weighted by their length
+        else: weights = nb_starts
+        self._segment_probabilities = weights / weights.sum()
+
+    def _choose_start_idx(self):
+        if self.dataset_sampling == "switch": return super()._choose_start_idx()
+        segment = np.random.choice(len(self._segment_probabilities), p= self._segment_probabilities)
+        self._use_dataset_path(self.dataset_pathes[segment])
+        return np.random.randint(low = self._segment_low[segment], high = self._segment_high[segment])
+
+    def _episode_last_idx(self, start_idx):
+        if self.dataset_sampling == "switch": return super()._episode_last_idx(start_idx)
+        return self._segment_bounds[np.searchsorted(self._segment_bounds, start_idx, side= "right")] - 1
+
+    def _history_size(self):
+        if self.dataset_sampling == "switch": return super()._history_size()
+        longest = int(np.max(np.diff(self._segment_bounds)))
+        return min(longest, self.max_episode_duration) if isinstance(self.max_episode_duration, int) else longest
+
+    def _get_dataset(self):
+        # The prepared dataset currently used by the environment (see TradingEnv._prepare_dataset)
+        return {attribute : getattr(self, attribute) for attribute in self._dataset_attributes}
+
+    def _switch_dataset(self):
+        dataset = None
+        if len(self._prefetch_queue) > 0:
+            dataset_path, future = self._prefetch_queue.popleft()
+            self._fill_prefetch_queue()
+            if future is not None:
+                dataset = future.result() # Raises the error of the background loading, if any
+                if self.dataset_cache is not None: self.dataset_cache.put(dataset_path, dataset)
+            self._use_dataset_path(dataset_path)
+        else:
+            dataset_path = self._next_dataset_path()
+        if dataset is None and self.dataset_cache is not None: dataset = self.dataset_cache.get(dataset_path)
+        if dataset is None:
+            dataset = self._prepare_dataset(self._load_dataset(dataset_path))
+            if self.dataset_cache is not None: self.dataset_cache.put(dataset_path, dataset)
+        self._set_dataset(dataset)
 
     def reset(self, seed=None, options = None, **kwargs):
-        self._episodes_on_this_dataset += 1
-        if self._episodes_on_this_dataset % self.episodes_between_dataset_switch == 0:
-            self._set_df(
-                self.next_dataset()
-            )
+        if self._profiler is not None: self._profiler.start()
+        if self.dataset_sampling == "switch":
+            self._episodes_on_this_dataset += 1
+            if self._episodes_on_this_dataset % self.episodes_between_dataset_switch == 0:
+                self._switch_dataset()
+        if self._profiler is not None: self._profiler.lap("dataset")
+        result = super().reset(seed = seed, options = options, **kwargs)
         if self.verbose > 1: print(f"Selected dataset {self.name} ...")
-        return super().reset(seed = seed, options = options, **kwargs)
+        return result
+
+    def close(self):
+        if self._prefetch_executor is not None:
+            self._prefetch_executor.shutdown(wait= False)
+            self._prefetch_executor = None
+            self._prefetch_queue.clear()
+        super().close()
     
+
+
+class BatchTradingEnv(gym.vector.VectorEnv):
+    """
+    A vectorized trading environment that runs ``num_envs`` portfolios on the same dataset within one process.
+    Unlike ``gym.make_vec('TradingEnv', ...)``, the market data is stored only once and the state of every portfolio is kept in numpy arrays,
+    so a step trades, updates interests and valuates all the portfolios at once.
+
+    It uses the same trading logic as TradingEnv with its default settings : the observations contain the features of your DataFrame followed by
+    the two default dynamic features (last position taken and real position) and the reward is the log return of the portfolio valuation.
+    Environments are automatically reset in the step where they end : the last observation and info of the ended episode are available in
+    ``info['final_obs']`` and ``info['final_info']``.
+
+    .. code-block:: python
+
+        from gym_trading_env.environments import BatchTradingEnv
+        env = BatchTradingEnv(df, num_envs = 256, positions = [-1, 0, 1], max_episode_duration = 500)
+        observations, infos = env.reset(seed = 42)
+        observations, rewards, dones, truncateds, infos = env.step(env.action_space.sample())
+
+    :param df: The market DataFrame. See TradingEnv.
+    :type df: pandas.DataFrame
+
+    :param num_envs: Number of portfolios simulated in parallel.
+    :type num_envs: int
+
+    The other parameters (``positions``, ``windows``, ``trading_fees``, ``borrow_interest_rate``, ``portfolio_initial_value``, ``initial_position``, ``max_episode_duration``, ``name``) behave like in TradingEnv.
+    """
+    def __init__(self,
+                df : pd.DataFrame,
+                num_envs : int,
+                positions : list = [0, 1],
+                windows = None,
+                trading_fees = 0,
+                borrow_interest_rate = 0,
+                portfolio_initial_value = 1000,
+                initial_position ='random',
+                max_episode_duration = 'max',
+                name = "Stock",
+                ):
+        self.num_envs = num_envs
+        self.name = name
+        self.positions = positions
+        self.windows = windows
+        self.trading_fees = trading_fees
+        self.borrow_interest_rate = borrow_interest_rate
+        self.portfolio_initial_value = float(portfolio_initial_value)
+        self.initial_position = initial_position
+        assert self.initial_position in self.positions or self.initial_position == 'random', "The 'initial_position' parameter must be 'random' or a position mentionned in the 'position' (default is [0, 1]) parameter."
+        self.max_episode_duration = max_episode_duration
+        self.metadata = {"autoreset_mode": gym.vector.AutoresetMode.SAME_STEP} if hasattr(gym.vector, "AutoresetMode") else {}
+        self.render_mode = None
+        self.closed = False
+        self._np_random, _ = gym.utils.seeding.np_random()
+        self._set_df(df)
+
+        self._positions_array = np.array(self.positions, dtype= np.float64)
+        self.single_action_space = spaces.Discrete(len(positions))
+        self.single_observation_space = spaces.Box(
+            -np.inf,
+            np.inf,
+            shape = [self._nb_features] if self.windows is None else [self.windows, self._nb_features]
+        )
+        self.action_space = gym.vector.utils.batch_space(self.single_action_space, self.num_envs)
+        self.observation_space = gym.vector.utils.batch_space(self.single_observation_space, self.num_envs)
+
+        self._idx = np.zeros(shape= (self.num_envs, ), dtype= np.int64)
+        self._step = np.zeros(shape= (self.num_envs, ), dtype= np.int64)
+        self._position = np.zeros(shape= (self.num_envs, ))
+        self._portfolio_valuation = np.zeros(shape= (self.num_envs, ))
+        self._portfolio = BatchPortfolio(asset = np.zeros(self.num_envs), fiat = np.zeros(self.num_envs))
+        self._dynamic_obs = np.zeros(shape= (self.num_envs, 1 if self.windows is None else self.windows, self._nb_dynamic_features), dtype= np.float32)
+
+    def _set_df(self, df):
+        self._features_columns = [col for col in df.columns if "feature" in col]
+        self._nb_static_features = len(self._features_columns)
+        self._nb_dynamic_features = 2 # Last position taken and real position
+        self._nb_features = self._nb_static_features + self._nb_dynamic_features
+        self._dates = df.index.values
+        self._obs_array = np.array(df[self._features_columns], dtype= np.float32)
+        self._price_array = np.array(df["close"], dtype= np.float64)
+        self._length = len(df)
+
+    def _reset_envs(self, mask):
+        nb_resets = int(mask.sum())
+        if nb_resets == 0: return
+        start = 0 if self.windows is None else self.windows - 1
+        if self.max_episode_duration != 'max':
+            idx = self._np_random.integers(low = start, high = self._length - self.max_episode_duration - start, size= nb_resets)
+        else:
+            idx = np.full(nb_resets, start)
+        if self.initial_position == 'random':
+            position = self._positions_array[self._np_random.integers(len(self.positions), size= nb_resets)]
+        else:
+            position = np.full(nb_resets, float(self.initial_position))
+        self._idx[mask] = idx
+        self._step[mask] = 0
+        self._position[mask] = position
+        self._portfolio_valuation[mask] = self.portfolio_initial_value
+
+        full_position = np.zeros(self.num_envs)
+        full_position[mask] = position
+        self._portfolio.reset(mask, position = full_position, value = self.portfolio_initial_value, price = self._price_array[self._idx])
+        # The dynamic features of the steps preceding the start of the episode are 0, as in a freshly created TradingEnv
+        self._dynamic_obs[mask] = 0
+        self._dynamic_obs[mask, -1, 0] = position
+        self._dynamic_obs[mask, -1, 1] = position
+
+    def _update_dynamic_obs(self, real_position):
+        if self.windows is not None:
+            self._dynamic_obs[:, :-1] = self._dynamic_obs[:, 1:]
+        self._dynamic_obs[:, -1, 0] = self._position
+        self._dynamic_obs[:, -1, 1] = real_position
+
+    def _get_obs(self):
+        if self.windows is None:
+            return np.concatenate([self._obs_array[self._idx], self._dynamic_obs[:, -1]], axis = 1)
+        _step_indexes = self._idx[:, None] + np.arange(1 - self.windows, 1)[None, :]
+        return np.concatenate([self._obs_array[_step_indexes], self._dynamic_obs], axis = 2)
+
+    def _get_info(self, reward, real_position):
+        return {
+            "idx" : self._idx.copy(),
+            "step" : self._step.copy(),
+            "date" : self._dates[self._idx],
+            "position" : self._position.copy(),
+            "real_position" : real_position,
+            "portfolio_valuation" : self._portfolio_valuation.copy(),
+            "reward" : reward,
+        }
+
+    def reset(self, seed = None, options = None):
+        if seed is not None:
+            self._np_random, _ = gym.utils.seeding.np_random(seed)
+        mask = np.ones(self.num_envs, dtype= bool)
+        if options is not None and "reset_mask" in options:
+            mask = np.asarray(options["reset_mask"], dtype= bool)
+        self._reset_envs(mask)
+        return self._get_obs(), self._get_info(np.zeros(self.num_envs), self._dynamic_obs[:, -1, 1].astype(np.float64))
+
+    def step(self, position_indexes):
+        # Trade
+        positions = self._positions_array[np.asarray(position_indexes)]
+        trade_mask = positions != self._position
+        self._portfolio.trade_to_position(positions, price = self._price_array[self._idx], trading_fees = self.trading_fees, mask = trade_mask)
+        self._position = np.where(trade_mask, positions, self._position)
+        self._idx += 1
+        self._step += 1
+
+        price = self._price_array[self._idx]
+        self._portfolio.update_interest(borrow_interest_rate= self.borrow_interest_rate)
+        previous_valuation = self._portfolio_valuation
+        self._portfolio_valuation = self._portfolio.valorisation(price)
+
+        dones = self._portfolio_valuation <= 0
+        truncateds = self._idx >= self._length - 1
+        if isinstance(self.max_episode_duration,int):
+            truncateds |= self._step >= self.max_episode_duration - 1
+
+        with np.errstate(divide= "ignore", invalid= "ignore"):
+            real_position = self._portfolio.real_position(price)
+            rewards = np.where(dones, 0., np.log(self._portfolio_valuation / previous_valuation))
+        self._update_dynamic_obs(real_position)
+        observations = self._get_obs()
+        infos = self._get_info(rewards, real_position)
+
+        ended = dones | truncateds
+        if ended.any():
+            final_obs = np.full(self.num_envs, fill_value= None, dtype= object)
+            for i in np.flatnonzero(ended): final_obs[i] = observations[i].copy()
+            final_info = infos
+            self._reset_envs(ended)
+            observations[ended] = self._get_obs()[ended]
+            infos = self._get_info(np.where(ended, 0., rewards), np.where(ended, self._position, real_position))
+            infos["final_obs"], infos["_final_obs"] = final_obs, ended
+            infos["final_info"], infos["_final_info"] = final_info, ended
+        return observations, rewards, dones, truncateds, infos
@@ -0,0 +1,155 @@
+import numpy as np
+
+class Metric:
+    """
+    Base class of the metrics computed online : ``reset`` is called at the start of an episode, ``on_trade`` after every trade and ``update`` at every step.
+    ``result`` returns the numeric value of the metric and ``format`` is only used to display it in the logs.
+    """
+    format = "{}"
+    def reset(self, valuation, position, real_position, price):
+        pass
+    def update(self, valuation, position, real_position, price):
+        pass
+    def on_trade(self, traded_value, fees):
+        pass
+    def result(self):
+        raise NotImplementedError
+    def compute(self, valuations, positions, real_positions, prices, trades, traded_values, fees):
+        # Result of a whole episode given as arrays (first element = reset). Replays the episode by default, built-in metrics use numpy.
+        self.reset(valuations[0], positions[0], real_positions[0], prices[0])
+        for t in range(1, len(valuations)):
+            if trades[t]: self.on_trade(traded_values[t], fees[t])
+            self.update(valuations[t], positions[t], real_positions[t], prices[t])
+        return self.result()
+    def formatted(self, value):
+        return self.format.format(value)
+    def get_state(self):
+        # Running state, captured by TradingEnv.snapshot. Subclasses holding mutable objects must copy them.
+        return dict(self.__dict__)
+    def set_state(self, state):
+        self.__dict__.update(state)
+
+class MarketReturn(Metric):
+    """Return of the asset price during the episode."""
+    format = "{:5.2%}"
+    def reset(self, valuation, position, real_position, price):
+        self._first_price, self._last_price = price, price
+    def update(self, valuation, position, real_position, price):
+        self._last_price = price
+    def result(self):
+        return self._last_price / self._first_price - 1
+    def compute(self, valuations, positions, real_positions, prices, trades, traded_values, fees):
+        return prices[-1] / prices[0] - 1
+
+class PortfolioReturn(Metric):
+    """Return of the portfolio valuation during the episode."""
+    format = "{:5.2%}"
+    def reset(self, valuation, position, real_position, price):
+        self._first_valuation, self._last_valuation = valuation, valuation
+    def update(self, valuation, position, real_position, price):
+        self._last_valuation = valuation
+    def result(self):
+        return self._last_valuation / self._first_valuation - 1
+    def compute(self, valuations, positions, real_positions, prices, trades, traded_values, fees):
+        return valuations[-1] / valuations[0] - 1
+
+class SharpeRatio(Metric):
+    """
+    Sharpe ratio of the step returns of the portfolio, from running moments of the returns.
+
+    :param periods: Number of steps per year (or any period) to annualize the ratio. Default is 1 (no annualization).
+    :type periods: optional - int or float
+    """
+    format = "{:.3f}"
+    def __init__(self, periods = 1):
+        self.periods = periods
+    def reset(self, valuation, position, real_position, price):
+        self._last_valuation = valuation
+        self._count, self._mean, self._m2 = 0, 0., 0.
+    def update(self, valuation, position, real_position, price):
+        r = valuation / self._last_valuation - 1
+        self._last_valuation = valuation
+        # Welford's online algorithm
+        self._count += 1
+        delta = r - self._mean
+        self._mean += delta / self._count
+        self._m2 += delta * (r - self._mean)
+    def _ratio(self, mean, deviation):
+        return mean / deviation * np.sqrt(self.periods) if deviation > 0 else np.nan
+    def result(self):
+        if self._count < 2: return np.nan
+        return self._ratio(self._mean, np.sqrt(self._m2 / (self._count - 1)))
+    def compute(self, valuations, positions, real_positions, prices, trades, traded_values, fees):
+        returns = valuations[1:] / valuations[:-1] - 1
+        if len(returns) < 2: return np.nan
+        return self._ratio(returns.mean(), returns.std(ddof = 1))
+
+class SortinoRatio(SharpeRatio):
+    """
+    Sortino ratio of the step returns of the portfolio : like the Sharpe ratio, but only the negative returns are used to compute the deviation.
+
+    :param periods: Number of steps per year (or any period) to annualize the ratio. Default is 1 (no annualization).
+    :type periods: optional - int or float
+    """
+    def reset(self, valuation, position, real_position, price):
+        super().reset(valuation, position, real_position, price)
+        self._downside_sum = 0.
+    def update(self, valuation, position, real_position, price):
+        r = valuation / self._last_valuation - 1
+        super().update(valuation, position, real_position, price)
+        self._downside_sum += min(r, 0)**2
+    def result(self):
+        if self._count < 1: return np.nan
+        return self._ratio(self._mean, np.sqrt(self._downside_sum / self._count))
+    def compute(self, valuations, positions, real_positions, prices, trades, traded_values, fees):
+        returns = valuations[1:] / valuations[:-1] - 1
+        if len(returns) < 1: return np.nan
+        return self._ratio(returns.mean(), np.sqrt(np.mean(np.minimum(returns, 0)**2)))
+
+class MaxDrawdown(Metric):
+    """Maximum drawdown of the portfolio valuation (as a positive fraction of the highest valuation reached before)."""
+    format = "{:5.2%}"
+    def reset(self, valuation, position, real_position, price):
+        self._max_valuation, self._max_drawdown = valuation, 0.
+    def update(self, valuation, position, real_position, price):
+        self._max_valuation = max(self._max_valuation, valuation)
+        self._max_drawdown = max(self._max_drawdown, 1 - valuation / self._max_valuation)
+    def result(self):
+        return self._max_drawdown
+    def compute(self, valuations, positions, real_positions, prices, trades, traded_values, fees):
+        return max(0., np.max(1 - valuations / np.maximum.accumulate(valuations)))
+
+class TradeCount(Metric):
+    """Number of trades (position changes) during the episode."""
+    def reset(self, valuation, position, real_position, price):
+        self._count = 0
+    def on_trade(self, traded_value, fees):
+        self._count += 1
+    def result(self):
+        return self._count
+    def compute(self, valuations, positions, real_positions, prices, trades, traded_values, fees):
+        return int(np.sum(trades))
+
+class Turnover(Metric):
+    """Total traded value during the episode, relative to the initial portfolio valuation."""
+    format = "{:.2f}"
+    def reset(self, valuation, position, real_position, price):
+        self._initial_valuation, self._traded_value = valuation, 0.
+    def on_trade(self, traded_value, fees):
+        self._traded_value += traded_value
+    def result(self):
+        return self._traded_value / self._initial_valuation
+    def compute(self, valuations, positions, real_positions, prices, trades, traded_values, fees):
+        return np.sum(traded_values) / valuations[0]
+
+class FeesPaid(Metric):
+    """Total trading fees paid during the episode (in fiat)."""
+    format = "{:.2f}"
+    def reset(self, valuation, position, real_position, price):
+        self._fees = 0.
+    def on_trade(self, traded_value, fees):
+        self._fees += fees
+    def result(self):
+        return self._fees
+    def compute(self, valuations, positions, real_positions, prices, trades, traded_values, fees):
+        return np.sum(fees)
@@ -0,0 +1,79 @@
+import numpy as np
+from .utils.incremental import IncrementalFunction
+
+class LogReturn(IncrementalFunction):
+    """Log return of the portfolio valuation : :math:`r_{t} = ln(\\frac{p_{t}}{p_{t-1}})`. Same as the default reward function."""
+    def reset(self, valuation, position, real_position, price):
+        self._last_valuation = valuation
+        self.value = 0.
+        return self.value
+    def update(self, valuation, position, real_position, price):
+        self.value = np.log(valuation / self._last_valuation)
+        self._last_valuation = valuation
+        return self.value
+
+class DifferentialSharpe(IncrementalFunction):
+    """
+    Differential Sharpe ratio (Moody & Saffell) : the contribution of the last return to an exponential moving estimate of the Sharpe ratio.
+
+    :param eta: Adaptation rate of the moving estimates of the first and second moments of the returns.
+    :type eta: optional - float
+    """
+    def __init__(self, eta = 0.01):
+        self.eta = eta
+    def reset(self, valuation, position, real_position, price):
+        self._last_valuation = valuation
+        self._mean, self._square_mean = 0., 0.
+        self.value = 0.
+        return self.value
+    def update(self, valuation, position, real_position, price):
+        r = valuation / self._last_valuation - 1
+        delta_mean, delta_square_mean = r - self._mean, r**2 - self._square_mean
+        variance = self._square_mean - self._mean**2
+        self.value = (self._square_mean * delta_mean - 0.5 * self._mean * delta_square_mean) / variance**1.5 if variance > 0 else 0.
+        self._mean += self.eta * delta_mean
+        self._square_mean += self.eta * delta_square_mean
+        self._last_valuation = valuation
+        return self.value
+
+class DrawdownPenalizedReturn(IncrementalFunction):
+    """
+    Log return of the portfolio valuation minus a penalty proportional to the current drawdown (``1 - valuation / max valuation of the episode``).
+
+    :param penalty: Weight of the drawdown penalty.
+    :type penalty: optional - float
+    """
+    def __init__(self, penalty = 1.):
+        self.penalty = penalty
+    def reset(self, valuation, position, real_position, price):
+        self._last_valuation = valuation
+        self._max_valuation = valuation
+        self.value = 0.
+        return self.value
+    def update(self, valuation, position, real_position, price):
+        self._max_valuation = max(self._max_valuation, valuation)
+        self.value = np.log(valuation / self._last_valuation) - self.penalty * (1 - valuation / self._max_valuation)
+        self._last_valuation = valuation
+        return self.value
+
+class PositionChangePenalty(IncrementalFunction):
+    """
+    Reward of ``reward`` (default : LogReturn) minus a penalty proportional to the size of the position change : :math:`penalty \\times |position_{t} - position_{t-1}|`.
+
+    :param penalty: Weight of the position change penalty.
+    :type penalty: optional - float
+
+    :param reward: The built-in reward to penalize.
+    :type reward: optional - IncrementalFunction
+    """
+    def __init__(self, penalty = 0.001, reward = None):
+        self.penalty = penalty
+        self.reward = LogReturn() if reward is None else reward
+    def reset(self, valuation, position, real_position, price):
+        self._last_position = position
+        self.value = self.reward.reset(valuation, position, real_position, price)
+        return self.value
+    def update(self, valuation, position, real_position, price):
+        self.value = self.reward.update(valuation, position, real_position, price) - self.penalty * abs(position - self._last_position)
+        self._last_position = position
+        return self.value
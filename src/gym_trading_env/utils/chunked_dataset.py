@@ -0,0 +1,201 @@
+import os
+import shutil
+import numpy as np
+
+from .dataset_store import DatasetStore, ColumnStack, split_columns
+from .dataset_cache import DatasetCache
+
+class ChunkedArray:
+    """Read-only array-like access to one array of every chunk of a ChunkedDataset : the chunks are loaded when their rows are read."""
+    def __init__(self, dataset, select):
+        self.dataset = dataset
+        self.select = select
+    def __len__(self):
+        return len(self.dataset)
+    def _get(self, chunk_index, rows, columns):
+        array = self.select(self.dataset._get_chunk(chunk_index))
+        return array[rows] if columns is None else array[rows, columns]
+    def __getitem__(self, key):
+        rows, columns = key if isinstance(key, tuple) else (key, None)
+        offsets = self.dataset.offsets
+        if isinstance(rows, (int, np.integer)):
+            if rows < 0: rows += len(self)
+            if rows < 0 or rows >= len(self): raise IndexError(f"index {rows} is out of bounds for a dataset of size {len(self)}")
+            chunk_index = self.dataset._chunk_index(rows)
+            return self._get(chunk_index, rows - offsets[chunk_index], columns)
+        rows = np.arange(*rows.indices(len(self))) if isinstance(rows, slice) else np.asarray(rows, dtype= np.int64)
+        rows = np.where(rows < 0, rows + len(self), rows)
+        if len(rows) == 0: return self._get(0, rows, columns)
+        # One piece per run of consecutive rows in the same chunk
+        chunk_indexes = self.dataset._chunk_index(rows)
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(chunk_indexes)) + 1, [len(rows)]])
+        pieces = [
+            self._get(chunk_indexes[start], rows[start:stop] - offsets[chunk_indexes[start]], columns)
+            for start, stop in zip(starts[:-1], starts[1:])
+        ]
+        if len(pieces) == 1: return pieces[0]
+        if isinstance(pieces[0], list): return [np.concatenate(column_pieces) for column_pieces in zip(*pieces)]
+        return np.concatenate(pieces)
+
+class ChunkedDataset(DatasetStore):
+    """
+    Dataset split in chunks (eg. Parquet row groups), for datasets that do not fit in memory. It can be given to TradingEnv instead of a DataFrame, like a DatasetStore.
+    A chunk is only loaded when the environment reads one of its rows and only the ``max_loaded_chunks`` last used chunks are kept in memory :
+    an episode starting at a random point only loads the chunks it goes through. Observations using ``windows`` can overlap two chunks, hence the default of 2 chunks.
+
+    Use ``ChunkedDataset.from_parquet`` for a Parquet file and ``ChunkedDataset.from_chunks`` for an iterable (eg. a generator) of DataFrames.
+    A single ``.npy`` feature matrix too large for the memory does not need chunks : it is memory-mapped by a ``DatasetStore``.
+
+    :param chunk_lengths: Number of rows of every chunk.
+    :type chunk_lengths: list[int]
+
+    :param load_chunk: Function taking the index of a chunk and returning the chunk as a DataFrame (or a DatasetStore). It must be picklable to be used in other processes.
+    :type load_chunk: function<int->pandas.DataFrame>
+
+    :param max_loaded_chunks: Number of chunks kept in memory.
+    :type max_loaded_chunks: optional - int
+
+    :param columns: Columns of the chunks. Default is None : the first chunk is loaded to find them.
+    :type columns: optional - list[str]
+
+    :param index_name: Name of the index of the chunks.
+    :type index_name: optional - str
+    """
+    def __init__(self, chunk_lengths, load_chunk, max_loaded_chunks = 2, columns = None, index_name = None):
+        self.chunk_lengths = np.asarray(chunk_lengths, dtype= np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(self.chunk_lengths)])
+        self.load_chunk = load_chunk
+        self.max_loaded_chunks = max_loaded_chunks
+        self._open(columns, index_name)
+
+    @classmethod
+    def from_parquet(cls, path, columns = None, max_loaded_chunks = 2):
+        """
+        Dataset of a Parquet file, one chunk per row group (requires ``pyarrow``).
+
+        :param columns: Columns to load. Default is None : every column.
+        :type columns: optional - list[str]
+        """
+        loader = ParquetChunkLoader(path, columns)
+        metadata = loader.file.metadata
+        schema = loader.file.schema_arrow
+        index_columns = loader.index_columns
+        if columns is None:
+            columns = [name for name in schema.names if name not in index_columns]
+        index_name = index_columns[0] if len(index_columns) == 1 and isinstance(index_columns[0], str) else None
+        return cls(
+            chunk_lengths= [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)],
+            load_chunk= loader,
+            max_loaded_chunks= max_loaded_chunks,
+            columns= columns,
+            index_name= index_name,
+        )
+
+    @classmethod
+    def from_chunks(cls, chunks, directory, max_loaded_chunks = 2):
+        """
+        Dataset of an iterable of DataFrames (eg. a generator reading a large file by parts). As a generator can only be read once, in order,
+        each chunk is written in ``directory`` (as a DatasetStore) and read back from there when needed.
+        """
+        chunk_lengths, columns, index_name = [], None, None
+        for i, chunk in enumerate(chunks):
+            if columns is None: columns, index_name = list(chunk.columns), chunk.index.name
+            elif list(chunk.columns) != columns:
+                raise ValueError(f"Every chunk must have the same columns. Chunk {i} has the columns {list(chunk.columns)} instead of {columns}")
+            chunk_dir = os.path.join(directory, f"chunk_{i}")
+            shutil.rmtree(chunk_dir, ignore_errors= True) # Left by a previous dataset
+            DatasetStore.create(chunk_dir, chunk)
+            chunk_lengths.append(len(chunk))
+        if len(chunk_lengths) == 0: raise ValueError("No chunk to read.")
+        return cls(
+            chunk_lengths= chunk_lengths,
+            load_chunk= StoreChunkLoader(directory),
+            max_loaded_chunks= max_loaded_chunks,
+            columns= columns,
+            index_name= index_name if isinstance(index_name, str) else None,
+        )
+
+    def _open(self, columns = None, index_name = None):
+        self._chunks = DatasetCache(max_entries= self.max_loaded_chunks)
+        if columns is None:
+            chunk = self.load_chunk(0)
+            columns = list(chunk.columns)
+            index_name = chunk.metadata["index_name"] if isinstance(chunk, DatasetStore) else chunk.index.name
+        self.columns = list(columns)
+        self.features_columns, self.info_columns = split_columns(self.columns)
+        self.metadata = {"columns" : self.columns, "features_columns" : self.features_columns, "info_columns" : self.info_columns, "index_name" : index_name}
+        self.features = ChunkedArray(self, lambda chunk : chunk["features"])
+        self.info = ChunkedArray(self, lambda chunk : chunk["info"])
+        self.dates = ChunkedArray(self, lambda chunk : chunk["dates"])
+
+    def _chunk_index(self, rows):
+        return np.searchsorted(self.offsets, rows, side= "right") - 1
+
+    def _get_chunk(self, chunk_index):
+        chunk = self._chunks.get(chunk_index)
+        if chunk is None:
+            chunk = self._prepare_chunk(chunk_index, self.load_chunk(chunk_index))
+            self._chunks.put(chunk_index, chunk)
+        return chunk
+
+    def _prepare_chunk(self, chunk_index, chunk):
+        if len(chunk) != self.chunk_lengths[chunk_index]:
+            raise ValueError(f"Chunk {chunk_index} has {len(chunk)} rows instead of {self.chunk_lengths[chunk_index]}")
+        if isinstance(chunk, DatasetStore):
+            return {"features" : chunk.features, "info" : chunk.info, "dates" : chunk.dates}
+        return {
+            "features" : np.ascontiguousarray(chunk[self.features_columns], dtype= np.float32).reshape(len(chunk), len(self.features_columns)),
+            "info" : ColumnStack([chunk[column].to_numpy() for column in self.info_columns]),
+            "dates" : chunk.index.to_numpy(),
+        }
+
+    def __getstate__(self):
+        # The loaded chunks are not pickled
+        return {
+            "chunk_lengths" : self.chunk_lengths,
+            "load_chunk" : self.load_chunk,
+            "max_loaded_chunks" : self.max_loaded_chunks,
+            "columns" : self.columns,
+            "index_name" : self.metadata["index_name"],
+        }
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def column(self, name):
+        if name in self.info_columns:
+            i = self.info_columns.index(name)
+            return ChunkedArray(self, lambda chunk : chunk["info"].columns[i])
+        i = self.features_columns.index(name)
+        return ChunkedArray(self, lambda chunk : chunk["features"][:, i])
+
+class ParquetChunkLoader:
+    """Reads the row groups of a Parquet file (the file is opened again after unpickling)."""
+    def __init__(self, path, columns = None):
+        self.path = path
+        self.columns = columns
+        self._open()
+    def _open(self):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Reading Parquet files requires pyarrow : pip install pyarrow")
+        self.file = pq.ParquetFile(self.path)
+        pandas_metadata = self.file.schema_arrow.pandas_metadata or {}
+        self.index_columns = [column for column in pandas_metadata.get("index_columns", []) if isinstance(column, str)]
+    def __call__(self, chunk_index):
+        columns = None if self.columns is None else list(self.columns) + [column for column in self.index_columns if column not in self.columns]
+        return self.file.read_row_group(chunk_index, columns= columns, use_pandas_metadata= True).to_pandas()
+    def __getstate__(self):
+        return {"path" : self.path, "columns" : self.columns}
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+class StoreChunkLoader:
+    """Opens the chunks written by ChunkedDataset.from_chunks."""
+    def __init__(self, directory):
+        self.directory = directory
+    def __call__(self, chunk_index):
+        return DatasetStore(os.path.join(self.directory, f"chunk_{chunk_index}"))
@@ -0,0 +1,61 @@
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+def dataset_nbytes(dataset):
+    # Approximate memory used by a prepared dataset (dict of attributes)
+    nbytes = 0
+    for value in dataset.values():
+        if isinstance(value, np.memmap):
+            continue # Memory-mapped arrays (see DatasetStore) are not held by the cache
+        if isinstance(value, np.ndarray):
+            nbytes += value.nbytes
+        elif isinstance(value, pd.DataFrame):
+            nbytes += int(value.memory_usage(index = True, deep = False).sum())
+    return nbytes
+
+class DatasetCache:
+    """
+    Least recently used cache of prepared datasets.
+
+    :param max_entries: Maximum number of datasets kept in memory. None means no limit.
+    :type max_entries: optional - int
+
+    :param max_bytes: Maximum memory used by the datasets kept in memory. None means no limit.
+    :type max_bytes: optional - int
+    """
+    def __init__(self, max_entries = None, max_bytes = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._datasets = OrderedDict()
+        self._nbytes = {}
+        self.nbytes = 0
+        self.hits, self.misses = 0, 0
+    def get(self, key):
+        if key not in self._datasets:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._datasets.move_to_end(key)
+        return self._datasets[key]
+    def put(self, key, dataset):
+        if key in self._datasets: self._remove(key)
+        nbytes = dataset_nbytes(dataset)
+        if self.max_bytes is not None and nbytes > self.max_bytes: return
+        self._datasets[key] = dataset
+        self._nbytes[key] = nbytes
+        self.nbytes += nbytes
+        # Evict the least recently used datasets
+        while (self.max_entries is not None and len(self._datasets) > self.max_entries) or (self.max_bytes is not None and self.nbytes > self.max_bytes):
+            self._remove(next(iter(self._datasets)))
+    def _remove(self, key):
+        del self._datasets[key]
+        self.nbytes -= self._nbytes.pop(key)
+    def clear(self):
+        self._datasets.clear()
+        self._nbytes.clear()
+        self.nbytes = 0
+    def __contains__(self, key):
+        return key in self._datasets
+    def __len__(self):
+        return len(self._datasets)
@@ -0,0 +1,129 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+class DatasetFormat:
+    """
+    Reader and writer of a file format for the datasets.
+
+    :param read: Function taking the path of the file and the list of columns to load (None means every column) and returning a DataFrame.
+    :param write: Function taking a DataFrame and the path of the file.
+    """
+    def __init__(self, name, extensions, read, write):
+        self.name = name
+        self.extensions = extensions
+        self.read = read
+        self.write = write
+
+DATASET_FORMATS = {}
+
+def register_dataset_format(name, extensions, read, write):
+    """
+    Add a dataset format (or replace an existing one), usable by ``MultiDatasetTradingEnv`` and the downloader.
+
+    :param name: Name of the format (eg. 'parquet').
+    :type name: str
+
+    :param extensions: File extensions of the format, the first one is used when writing files (eg. ['.parquet', '.pq']).
+    :type extensions: list[str]
+
+    :param read: Function taking the path of the file and the list of columns to load (None means every column) and returning a DataFrame.
+    :type read: function<str, list or None -> pandas.DataFrame>
+
+    :param write: Function taking a DataFrame and the path of the file.
+    :type write: function<pandas.DataFrame, str>
+    """
+    DATASET_FORMATS[name] = DatasetFormat(name, list(extensions), read, write)
+
+def get_dataset_format(path = None, format = None):
+    if format is not None:
+        if format not in DATASET_FORMATS: raise ValueError(f"Unknown dataset format {format} ... Available formats : {list(DATASET_FORMATS.keys())}")
+        return DATASET_FORMATS[format]
+    extension = os.path.splitext(path)[1].lower()
+    for dataset_format in DATASET_FORMATS.values():
+        if extension in dataset_format.extensions: return dataset_format
+    raise ValueError(f"Unknown dataset extension {extension} for {path} ... Available formats : {[(dataset_format.name, dataset_format.extensions) for dataset_format in DATASET_FORMATS.values()]}")
+
+def read_dataset(path, columns = None, format = None):
+    """
+    Read a dataset, loading only ``columns`` (and the index) when the format allows it. The format is found from the file extension unless ``format`` is given.
+    ``path`` can also be the directory of a partitioned dataset (eg. written by the downloader with ``partition = 'month'``) : its files are read in the order of their names and concatenated.
+    """
+    if os.path.isdir(path):
+        return pd.concat([read_dataset(partition_path, columns, format) for partition_path in partition_paths(path)])
+    return get_dataset_format(path, format).read(path, None if columns is None else list(columns))
+
+def partition_paths(directory):
+    # Files of a partitioned dataset, in order (hidden files are temporary files being written)
+    paths = [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if not name.startswith(".")]
+    if len(paths) == 0: raise FileNotFoundError(f"No partition found in {directory}")
+    return paths
+
+def write_dataset(df, path, format = None):
+    """Write a dataset. The format is found from the file extension unless ``format`` is given."""
+    get_dataset_format(path, format).write(df, path)
+
+def restore_dtype(array, dtype):
+    # Arrays of pandas specific dtypes (eg. category) are stored as objects
+    if str(array.dtype) != dtype:
+        try:
+            return pd.Series(array).astype(dtype).values
+        except (TypeError, ValueError, Warning):
+            pass
+    return array
+
+def _read_pickle(path, columns = None):
+    # The whole DataFrame is always deserialized
+    df = pd.read_pickle(path)
+    return df if columns is None else df[columns]
+
+def _write_pickle(df, path):
+    df.to_pickle(path)
+
+def _read_parquet(path, columns = None):
+    return pd.read_parquet(path, columns= columns)
+
+def _write_parquet(df, path):
+    df.to_parquet(path)
+
+def _read_feather(path, columns = None):
+    # The index is stored as the first column of the file
+    import pyarrow.feather as feather
+    index_name = feather.read_table(path, columns= [0], memory_map= True).column_names[0]
+    df = pd.read_feather(path, columns= None if columns is None else [index_name] + [column for column in columns if column != index_name])
+    df = df.set_index(index_name)
+    if index_name == "index": df.index.name = None
+    return df
+
+def _write_feather(df, path):
+    df.reset_index().to_feather(path)
+
+def _read_npz(path, columns = None):
+    # Members of a .npz archive are decompressed separately : only the requested columns are read
+    with np.load(path, allow_pickle= True) as npz:
+        metadata = json.loads(str(npz["metadata"]))
+        if columns is None: columns = metadata["columns"]
+        unknown_columns = [column for column in columns if column not in metadata["columns"]]
+        if len(unknown_columns) > 0: raise KeyError(f"Columns {unknown_columns} not found in {path} ... Available columns : {metadata['columns']}")
+        data = {}
+        for column in columns:
+            i = metadata["columns"].index(column)
+            data[column] = restore_dtype(npz[f"column_{i}"], metadata["dtypes"][i])
+        index = pd.Index(restore_dtype(npz["index"], metadata["index_dtype"]), name= metadata["index_name"])
+    return pd.DataFrame(data, index= index)
+
+def _write_npz(df, path):
+    arrays = {f"column_{i}" : df[column].to_numpy() for i, column in enumerate(df.columns)}
+    metadata = {
+        "columns" : list(df.columns),
+        "dtypes" : [str(dtype) for dtype in df.dtypes],
+        "index_name" : df.index.name if isinstance(df.index.name, str) else None,
+        "index_dtype" : str(df.index.dtype),
+    }
+    np.savez_compressed(path, metadata= np.array(json.dumps(metadata)), index= df.index.to_numpy(), **arrays)
+
+register_dataset_format("pickle", [".pkl", ".pickle"], _read_pickle, _write_pickle)
+register_dataset_format("parquet", [".parquet", ".pq"], _read_parquet, _write_parquet)
+register_dataset_format("feather", [".feather"], _read_feather, _write_feather)
+register_dataset_format("npz", [".npz"], _read_npz, _write_npz)
@@ -0,0 +1,126 @@
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+class ColumnStack:
+    """Read-only (rows, columns) access to a list of 1D arrays, without stacking them into one (object) matrix."""
+    def __init__(self, columns):
+        self.columns = columns
+    def __len__(self):
+        return len(self.columns[0]) if len(self.columns) > 0 else 0
+    @property
+    def shape(self):
+        return (len(self), len(self.columns))
+    def __getitem__(self, key):
+        rows, columns = key if isinstance(key, tuple) else (key, slice(None))
+        if isinstance(columns, (int, np.integer)): return self.columns[columns][rows]
+        columns = self.columns[columns] if isinstance(columns, slice) else [self.columns[i] for i in columns]
+        return [column[rows] for column in columns]
+
+def split_columns(columns):
+    # Features (observations) and info columns, as in TradingEnv
+    features_columns = [col for col in columns if "feature" in col]
+    info_columns = [col for col in columns if col not in features_columns]
+    if "close" not in info_columns: info_columns.append("close")
+    return features_columns, info_columns
+
+class DatasetStore:
+    """
+    Dataset stored once on disk in the layout used by the environments (``.npy`` files and a ``metadata.json`` file) and opened memory-mapped, read-only.
+    Every environment (or process) opening the same store shares the same physical memory : the operating system loads the pages once and they do not count
+    in the private memory of the processes. Pickling a store only pickles its directory, so it can be given to ``gym.make_vec(..., vectorization_mode = "async")``.
+
+    Create it once with ``DatasetStore.create(directory, df)``, then give it instead of the DataFrame : ``TradingEnv(df = DatasetStore(directory), ...)``.
+    The features (columns containing 'feature') are stored as a float32 matrix, the other columns as one array each. Columns holding Python objects (eg. strings)
+    can not be memory-mapped : they are loaded in memory.
+
+    :param directory: Directory of the store.
+    :type directory: str
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self._open()
+
+    @classmethod
+    def create(cls, directory, df, metadata = None):
+        """
+        Write ``df`` in ``directory`` (unless a store already exists there) and open it.
+
+        :param metadata: Additional values stored in the ``metadata.json`` file.
+        :type metadata: optional - dict
+        """
+        if cls.exists(directory): return cls(directory)
+        features_columns, info_columns = split_columns(list(df.columns))
+        parent_dir = os.path.dirname(os.path.abspath(directory))
+        os.makedirs(parent_dir, exist_ok= True)
+        # Write in a temporary directory, then move it : other processes never see a partial store
+        tmp_dir = tempfile.mkdtemp(dir= parent_dir, prefix= ".tmp_")
+        try:
+            np.save(os.path.join(tmp_dir, "features.npy"), np.ascontiguousarray(df[features_columns], dtype= np.float32).reshape(len(df), len(features_columns)))
+            for i, column in enumerate(info_columns):
+                np.save(os.path.join(tmp_dir, f"info_{i}.npy"), df[column].to_numpy(), allow_pickle= True)
+            np.save(os.path.join(tmp_dir, "index.npy"), df.index.to_numpy(), allow_pickle= True)
+            with open(os.path.join(tmp_dir, "metadata.json"), "w") as file:
+                json.dump({
+                    **(metadata or {}),
+                    "columns" : list(df.columns),
+                    "features_columns" : features_columns,
+                    "info_columns" : info_columns,
+                    "index_name" : df.index.name if isinstance(df.index.name, str) else None,
+                }, file)
+            os.rename(tmp_dir, directory)
+        except OSError:
+            # Another process created the same store first
+            shutil.rmtree(tmp_dir, ignore_errors= True)
+            if not cls.exists(directory): raise
+        return cls(directory)
+
+    @staticmethod
+    def exists(directory):
+        return os.path.exists(os.path.join(directory, "metadata.json"))
+
+    def _load(self, name):
+        path = os.path.join(self.directory, name)
+        try:
+            return np.load(path, mmap_mode= "r")
+        except ValueError: # Python objects can not be memory-mapped
+            return np.load(path, allow_pickle= True)
+
+    def _open(self):
+        with open(os.path.join(self.directory, "metadata.json")) as file:
+            self.metadata = json.load(file)
+        self.columns = self.metadata["columns"]
+        self.features_columns = self.metadata["features_columns"]
+        self.info_columns = self.metadata["info_columns"]
+        self.features = self._load("features.npy")
+        self.info = ColumnStack([self._load(f"info_{i}.npy") for i in range(len(self.info_columns))])
+        self.dates = self._load("index.npy")
+
+    def __getstate__(self):
+        return {"directory" : self.directory}
+    def __setstate__(self, state):
+        self.directory = state["directory"]
+        self._open()
+
+    def __len__(self):
+        return len(self.dates)
+    def __contains__(self, column):
+        return column in self.columns
+
+    def column(self, name):
+        if name in self.info_columns: return self.info.columns[self.info_columns.index(name)]
+        return self.features[:, self.features_columns.index(name)]
+
+    def row(self, i):
+        return pd.Series({column : self.column(column)[i] for column in self.columns}, name= self.dates[i])
+
+    def to_dataframe(self, start = None, stop = None):
+        """Load the dataset (or the rows from ``start`` to ``stop``) in a DataFrame (features are float32)."""
+        rows = slice(start, stop)
+        return pd.DataFrame(
+            {column : np.array(self.column(column)[rows]) for column in self.columns},
+            index= pd.Index(np.array(self.dates[rows]), name= self.metadata["index_name"])
+        )
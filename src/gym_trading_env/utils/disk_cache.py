@@ -0,0 +1,205 @@
+import functools
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import tempfile
+import types
+import numpy as np
+import pandas as pd
+
+from .dataset_formats import restore_dtype
+
+def file_fingerprint(path, chunk_size = 1 << 20):
+    # Hash of the content of a file (of the names and contents of its files for a directory)
+    file_hash = hashlib.blake2b(digest_size= 16)
+    paths = [os.path.join(path, name) for name in sorted(os.listdir(path)) if not name.startswith(".")] if os.path.isdir(path) else [path]
+    for file_path in paths:
+        if os.path.isdir(path): file_hash.update(os.path.basename(file_path).encode())
+        with open(file_path, "rb") as file:
+            for chunk in iter(lambda : file.read(chunk_size), b""):
+                file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+def function_fingerprint(function):
+    # Hash of the code of a function (source code when available, bytecode otherwise), of its default values, of the values it captured
+    # and of the module globals it uses : the helper functions it calls are hashed the same way, the arrays and DataFrames by their content
+    function_hash = hashlib.blake2b(digest_size= 16)
+    _hash_value(function_hash, function, set())
+    return function_hash.hexdigest()
+
+def _code_names(code):
+    # Global names used by a code object and by the functions defined inside it
+    names = set(code.co_names)
+    for constant in code.co_consts:
+        if inspect.iscode(constant): names |= _code_names(constant)
+    return names
+
+def _hash_function(function_hash, function, visited):
+    function_hash.update(f"{getattr(function, '__module__', '')}.{getattr(function, '__qualname__', '')}".encode())
+    # A function already hashed (recursive helpers) is only identified by its name
+    if id(function) in visited: return
+    visited.add(id(function))
+    code = getattr(function, "__code__", None)
+    try:
+        function_hash.update(inspect.getsource(function).encode())
+    except (OSError, TypeError):
+        if code is not None:
+            function_hash.update(code.co_code)
+            _hash_value(function_hash, [constant for constant in code.co_consts if not inspect.iscode(constant)], visited)
+            function_hash.update(repr(code.co_names).encode())
+    _hash_value(function_hash, getattr(function, "__defaults__", None), visited)
+    _hash_value(function_hash, getattr(function, "__kwdefaults__", None), visited)
+    for cell in getattr(function, "__closure__", None) or []:
+        try:
+            _hash_value(function_hash, cell.cell_contents, visited)
+        except ValueError: # Empty cell
+            pass
+    if code is None: return
+    function_globals = getattr(function, "__globals__", {})
+    for name in sorted(_code_names(code)):
+        # Attribute names (eg. 'log' in np.log) and builtins are not module globals
+        if name not in function_globals: continue
+        function_hash.update(name.encode())
+        _hash_value(function_hash, function_globals[name], visited)
+
+def _hash_value(value_hash, value, visited):
+    # The representation of many objects is truncated (arrays, DataFrames) or holds their memory address : they are hashed by content
+    if isinstance(value, (types.FunctionType, types.MethodType)):
+        if isinstance(value, types.MethodType): _hash_value(value_hash, value.__self__, visited)
+        _hash_function(value_hash, getattr(value, "__func__", value), visited)
+    elif isinstance(value, types.ModuleType):
+        value_hash.update(f"module {value.__name__}".encode())
+    elif isinstance(value, type):
+        value_hash.update(f"class {value.__module__}.{value.__qualname__}".encode())
+        try:
+            value_hash.update(inspect.getsource(value).encode())
+        except (OSError, TypeError):
+            pass
+    elif isinstance(value, np.ndarray):
+        value_hash.update(f"array {value.dtype} {value.shape}".encode())
+        if value.dtype.hasobject: _hash_value(value_hash, value.tolist(), visited)
+        else: value_hash.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, pd.DataFrame):
+        value_hash.update(b"DataFrame")
+        _hash_value(value_hash, value.index, visited)
+        _hash_value(value_hash, list(value.columns), visited)
+        for i in range(value.shape[1]): _hash_value(value_hash, value.iloc[:, i], visited)
+    elif isinstance(value, (pd.Series, pd.Index)):
+        value_hash.update(f"{type(value).__name__} {value.name!r} {value.dtype}".encode())
+        if isinstance(value, pd.Series): _hash_value(value_hash, value.index, visited)
+        _hash_value(value_hash, value.to_numpy(), visited)
+    elif isinstance(value, functools.partial):
+        _hash_value(value_hash, (value.func, value.args, value.keywords), visited)
+    elif isinstance(value, (list, tuple, set, frozenset, dict)):
+        if id(value) in visited: return
+        visited.add(id(value))
+        items = sorted(value, key= repr) if isinstance(value, (set, frozenset)) else (list(value.items()) if isinstance(value, dict) else value)
+        value_hash.update(f"{type(value).__name__} {len(items)}".encode())
+        for item in items: _hash_value(value_hash, item, visited)
+    elif type(value).__repr__ is object.__repr__:
+        # Instances without a representation of their own (eg. callable objects) : their class and their attributes
+        if id(value) in visited: return
+        visited.add(id(value))
+        _hash_value(value_hash, type(value), visited)
+        _hash_value(value_hash, getattr(value, "__dict__", None), visited)
+    else:
+        value_hash.update(f"{type(value).__name__} {value!r}".encode())
+
+class DiskDatasetCache:
+    """
+    Cache of preprocessed datasets stored on disk : one ``.npy`` file per column and a ``metadata.json`` file per dataset.
+    An entry is identified by the path, modification time and content hash of the source file, by the fingerprint of the preprocess function
+    (its code, its default and captured values and the module globals and helper functions it uses) and by ``cache_version``,
+    so it is invalidated when one of them changes.
+    The fingerprint does not follow the code of the imported modules nor the files read by the preprocess function : change ``cache_version`` when they change.
+
+    :param cache_dir: Directory of the cache. It is created if needed.
+    :type cache_dir: str
+
+    :param cache_version: Default is None. Any JSON value (eg. a string or a number) added to the key of the entries : changing it invalidates the whole cache.
+    :type cache_version: optional - str or int
+    """
+    def __init__(self, cache_dir, cache_version = None):
+        self.cache_dir = cache_dir
+        self.cache_version = cache_version
+        os.makedirs(self.cache_dir, exist_ok= True)
+        self._file_fingerprints = {}
+    def _source_fingerprint(self, path):
+        # The content hash is only computed again when the modification time or size of the file changes
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        if key not in self._file_fingerprints:
+            self._file_fingerprints[key] = file_fingerprint(path)
+        return key, self._file_fingerprints[key]
+    def key(self, path, preprocess, columns = None):
+        (source, mtime, size), content_hash = self._source_fingerprint(path)
+        return hashlib.blake2b(
+            json.dumps(
+                [source, mtime, size, content_hash, function_fingerprint(preprocess)] + ([] if columns is None else [list(columns)])
+                + ([] if self.cache_version is None else [{"cache_version" : self.cache_version}])
+            ).encode(),
+            digest_size= 16
+        ).hexdigest()
+    def source_metadata(self, path):
+        # Stored with an entry to find the entries built from older versions of the same source file
+        return {"source" : os.path.abspath(path), "source_fingerprint" : self._source_fingerprint(path)[1]}
+    def group_key(self, paths, preprocess, columns = None):
+        # Key of a dataset built from several source files
+        return hashlib.blake2b(
+            json.dumps([self.key(path, preprocess, columns) for path in paths]).encode(),
+            digest_size= 16
+        ).hexdigest()
+    def get(self, path, preprocess, columns = None):
+        entry_dir = os.path.join(self.cache_dir, self.key(path, preprocess, columns))
+        metadata_path = os.path.join(entry_dir, "metadata.json")
+        if not os.path.exists(metadata_path): return None
+        with open(metadata_path) as file:
+            metadata = json.load(file)
+        columns = {}
+        for i, (column, dtype) in enumerate(zip(metadata["columns"], metadata["dtypes"])):
+            columns[column] = self._load_array(os.path.join(entry_dir, f"column_{i}.npy"), dtype)
+        index = pd.Index(self._load_array(os.path.join(entry_dir, "index.npy"), metadata["index_dtype"]), name= metadata["index_name"])
+        return pd.DataFrame(columns, index= index)
+    def _load_array(self, path, dtype):
+        return restore_dtype(np.load(path, allow_pickle= True), dtype)
+    def put(self, path, preprocess, df, columns = None):
+        if not all(isinstance(column, str) for column in df.columns): return False
+        key = self.key(path, preprocess, columns)
+        entry_dir = os.path.join(self.cache_dir, key)
+        if os.path.exists(entry_dir): return True
+        # Write in a temporary directory, then move it : other processes never see a partial entry
+        tmp_dir = tempfile.mkdtemp(dir= self.cache_dir, prefix= ".tmp_")
+        try:
+            for i, column in enumerate(df.columns):
+                np.save(os.path.join(tmp_dir, f"column_{i}.npy"), df[column].to_numpy(), allow_pickle= True)
+            np.save(os.path.join(tmp_dir, "index.npy"), df.index.to_numpy(), allow_pickle= True)
+            with open(os.path.join(tmp_dir, "metadata.json"), "w") as file:
+                json.dump({
+                    **self.source_metadata(path),
+                    "columns" : list(df.columns),
+                    "dtypes" : [str(dtype) for dtype in df.dtypes],
+                    "index_name" : df.index.name if isinstance(df.index.name, str) else None,
+                    "index_dtype" : str(df.index.dtype),
+                }, file)
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Another process wrote the same entry first
+            shutil.rmtree(tmp_dir, ignore_errors= True)
+            return os.path.exists(entry_dir)
+        self.remove_outdated(path)
+        return True
+    def remove_outdated(self, path):
+        # Remove the entries built from older versions of the same source file
+        source, source_fingerprint = os.path.abspath(path), self._source_fingerprint(path)[1]
+        for entry in os.listdir(self.cache_dir):
+            metadata_path = os.path.join(self.cache_dir, entry, "metadata.json")
+            if not os.path.exists(metadata_path): continue
+            try:
+                with open(metadata_path) as file:
+                    metadata = json.load(file)
+                if metadata["source"] != source or metadata["source_fingerprint"] == source_fingerprint: continue
+            except (OSError, ValueError, KeyError):
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, entry), ignore_errors= True)
@@ -0,0 +1,97 @@
+import asyncio
+import random
+import time
+import numpy as np
+import pandas as pd
+import ccxt.async_support as ccxt
+
+class FakeExchange:
+    """
+    Local stand-in for a ccxt exchange, to run the downloader without network access : ``download(..., exchange_factory = lambda exchange_name : FakeExchange(...))``.
+    It generates deterministic OHLCV candles and simulates the latency of the responses, the rate limit of the exchange, transient network errors,
+    missing candles and duplicated candles. The missing candles are always the same, like the holes of a real market history.
+
+    :param latency: Mean duration of a request in seconds.
+    :type latency: optional - float
+
+    :param latency_jitter: Relative random variation of the latency (eg. 0.5 : +/- 50%).
+    :type latency_jitter: optional - float
+
+    :param rate_limit: Number of requests per second accepted by the exchange. The requests above it raise ``ccxt.RateLimitExceeded``. Default is None : no limit.
+    :type rate_limit: optional - float
+
+    :param error_rate: Probability of a request raising ``ccxt.RequestTimeout``.
+    :type error_rate: optional - float
+
+    :param gap_rate: Proportion of missing candles.
+    :type gap_rate: optional - float
+
+    :param duplicate_rate: Probability of a candle being returned twice in a response.
+    :type duplicate_rate: optional - float
+
+    :param listing_date: Date of the first candle of every symbol. Default is None : the exchange has candles since 1970.
+    :type listing_date: optional - datetime.datetime
+
+    :param seed: Seed of the random latencies, errors and duplicates.
+    :type seed: optional - int
+    """
+    def __init__(self, latency = 0, latency_jitter = 0.5, rate_limit = None, error_rate = 0, gap_rate = 0, duplicate_rate = 0, listing_date = None, seed = 0):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self.gap_rate = gap_rate
+        self.duplicate_rate = duplicate_rate
+        self.listing_timestamp = 0 if listing_date is None else int(pd.Timestamp(listing_date).timestamp() * 1E3)
+        self.random = random.Random(seed)
+        self._request_times = []
+        self.stats = {"requests" : 0, "rate_limited" : 0, "errors" : 0, "candles" : 0}
+
+    def _check_rate_limit(self):
+        # Sliding window of one second
+        now = time.monotonic()
+        self._request_times = [request_time for request_time in self._request_times if now - request_time < 1]
+        if len(self._request_times) >= self.rate_limit:
+            self.stats["rate_limited"] += 1
+            raise ccxt.RateLimitExceeded("FakeExchange : rate limit exceeded")
+        self._request_times.append(now)
+
+    @staticmethod
+    def _hash(timestamps, symbol):
+        # Deterministic value in [0, 1) for every candle
+        values = (timestamps // 1000 + sum(ord(character) for character in symbol) * 7919) * 2654435761 % 2**32
+        return values / 2**32
+
+    def candles(self, symbol, timeframe, since, limit):
+        """The candles returned by ``fetch_ohlcv``, without latency nor errors."""
+        timedelta = int(pd.Timedelta(timeframe) // pd.Timedelta(milliseconds= 1))
+        first = max(since, self.listing_timestamp)
+        first += (-first) % timedelta
+        now = int(time.time() * 1E3)
+        timestamps = np.arange(first, first + limit * timedelta, timedelta, dtype= np.int64)
+        timestamps = timestamps[timestamps <= now]
+        timestamps = timestamps[self._hash(timestamps, symbol) >= self.gap_rate]
+        close = 100 * np.exp(np.sin(timestamps / (1000 * 3600 * 24 * 30)) + 0.01 * self._hash(timestamps + timedelta, symbol))
+        open_price = 100 * np.exp(np.sin((timestamps - timedelta) / (1000 * 3600 * 24 * 30)) + 0.01 * self._hash(timestamps, symbol))
+        candles = [
+            [int(timestamp), float(open_value), float(max(open_value, close_value) * 1.001), float(min(open_value, close_value) * 0.999), float(close_value), float(volume)]
+            for timestamp, open_value, close_value, volume in zip(timestamps, open_price, close, 1000 * self._hash(timestamps + 1, symbol))
+        ]
+        if self.duplicate_rate > 0:
+            candles = [candle for candle in candles for _ in range(2 if self.random.random() < self.duplicate_rate else 1)]
+        return candles
+
+    async def fetch_ohlcv(self, symbol, timeframe = "1m", since = None, limit = 1000, params = {}):
+        self.stats["requests"] += 1
+        if self.rate_limit is not None: self._check_rate_limit()
+        if self.latency > 0:
+            await asyncio.sleep(self.latency * (1 + self.latency_jitter * (2 * self.random.random() - 1)))
+        if self.random.random() < self.error_rate:
+            self.stats["errors"] += 1
+            raise ccxt.RequestTimeout("FakeExchange : request timeout")
+        candles = self.candles(symbol, timeframe, 0 if since is None else since, limit)
+        self.stats["candles"] += len(candles)
+        return candles
+
+    async def close(self):
+        pass
@@ -1,76 +1,228 @@
 import numpy as np
+import numbers
+import datetime
+from collections.abc import Mapping
+
+def _infer_dtype(value):
+    # Every numeric value is stored as float64 unless a dtype is specified : it avoids truncating positions like 0.5 stored after an initial 0.
+    if isinstance(value, (bool, np.bool_)):
+        return np.bool_
+    if isinstance(value, numbers.Real):
+        return np.float64
+    if isinstance(value, (np.datetime64, datetime.datetime)):
+        # np.datetime64 has no timezone : the timezone-aware dates (eg. pd.Timestamp in UTC) are kept as objects
+        return object if getattr(value, "tzinfo", None) is not None else np.dtype("datetime64[ns]")
+    if isinstance(value, (np.timedelta64, datetime.timedelta)):
+        return np.dtype("timedelta64[ns]")
+    return object
 
 class History:
-    def __init__(self, max_size = 10000):
+    """
+    Columnar storage of the steps of an episode : one typed record per step, so that a step is written (and read) at once while every column stays a typed np.array.
+    With ``ring = True``, only the last ``max_size`` steps are kept : the oldest step is overwritten when the History is full and indexes are relative to the oldest step kept.
+    """
+    def __init__(self, max_size = 10000, dtypes = None, ring = False):
         self.height = max_size
+        self.dtypes = {} if dtypes is None else dict(dtypes)
+        self.ring = ring
+        self._names = None
+        self._start = 0 # Position in the arrays of the oldest step (always 0 without ring)
     def set(self, **kwargs):
-        # Flattening the inputs to put it in np.array
+        if self._names is not None:
+            # Same columns as before (eg. a new episode) : the arrays are reused
+            try:
+                self._check_layout(kwargs)
+            except ValueError:
+                pass
+            else:
+                self.size, self._start = 0, 0
+                self.add(**kwargs)
+                return
+        # Flattening the inputs : the layout (names, kinds and keys of the inputs) is computed once
         self.columns = []
+        self._names, self._layout = list(kwargs.keys()), []
         for name, value in kwargs.items():
             if isinstance(value, list):
-                self.columns.extend([f"{name}_{i}" for i in range(len(value))])
+                keys = list(range(len(value)))
+                self.columns.extend([f"{name}_{i}" for i in keys])
             elif isinstance(value, dict):
-                self.columns.extend([f"{name}_{key}" for key in value.keys()])
+                keys = list(value.keys())
+                self.columns.extend([f"{name}_{key}" for key in keys])
             else:
+                keys = None
                 self.columns.append(name)
-        
+            self._layout.append((type(value) if keys is not None else None, keys))
+
         self.width = len(self.columns)
-        self.history_storage = np.zeros(shape=(self.height, self.width), dtype= 'O')
-        self.size = 0
+        self.column_indexes = {column : i for i, column in enumerate(self.columns)}
+        values = self._flatten(kwargs)
+        self._allocate([np.dtype(self.dtypes.get(column, _infer_dtype(value))) for column, value in zip(self.columns, values)])
+        self.size, self._start = 0, 0
         self.add(**kwargs)
-    def add(self, **kwargs):
-        values = []
+    def _allocate(self, dtypes, arrays = None):
+        # One record per step (a structured np.array) : a step is written and read with one call. self._arrays (and self.history_storage) hold the views of the columns
+        self._storage = np.zeros(shape=(self.height, ), dtype= [(column, dtype) for column, dtype in zip(self.columns, dtypes)])
+        self._arrays = [self._storage[column] for column in self.columns]
+        if arrays is not None:
+            for array, values in zip(self._arrays, arrays): array[:] = values
+        self.history_storage = dict(zip(self.columns, self._arrays))
+        # Dates and durations are read as numpy scalars (item() would turn them into integers)
+        self._time_indexes = [column_index for column_index, dtype in enumerate(dtypes) if dtype.kind in "mM"]
+    def _flatten(self, kwargs):
+        # Values of the columns, in order. Only the names and keys of the inputs are checked here : _check_layout also checks the scalars, when the values can not be written
+        if list(kwargs) == self._names:
+            values = []
+            append, extend = values.append, values.extend
+            for (kind, keys), value in zip(self._layout, kwargs.values()):
+                if kind is None: append(value)
+                elif kind is dict and isinstance(value, dict) and list(value) == keys: extend(value.values())
+                elif kind is list and isinstance(value, list) and len(value) == len(keys): extend(value)
+                elif kind is dict and isinstance(value, dict) and len(value) == len(keys) and all(key in value for key in keys): extend([value[key] for key in keys])
+                else: break
+            else:
+                return values
+        raise self._layout_error(kwargs)
+    def _check_layout(self, kwargs):
+        values = self._flatten(kwargs)
+        for (kind, keys), value in zip(self._layout, kwargs.values()):
+            if kind is None and isinstance(value, (list, dict)): raise self._layout_error(kwargs)
+        return values
+    def _layout_error(self, kwargs):
         columns = []
         for name, value in kwargs.items():
-            if isinstance(value, list):
-                columns.extend([f"{name}_{i}" for i in range(len(value))])
-                values.extend(value[:])
-            elif isinstance(value, dict):
-                columns.extend([f"{name}_{key}" for key in value.keys()])
-                values.extend(list(value.values()))
-            else:
-                columns.append(name)
-                values.append(value)
-
-        if columns == self.columns:
-            self.history_storage[self.size, :] = values
-            self.size = min(self.size+1, self.height)
+            if isinstance(value, list): columns.extend([f"{name}_{i}" for i in range(len(value))])
+            elif isinstance(value, dict): columns.extend([f"{name}_{key}" for key in value.keys()])
+            else: columns.append(name)
+        return ValueError(f"Make sur that your inputs match the initial ones... Initial ones : {self.columns}. New ones {columns}")
+    def _write(self, column_index, t, value):
+        try:
+            self._view(column_index, t)[t] = value
+        except (TypeError, ValueError, OverflowError, UserWarning):
+            # The value does not fit the inferred dtype (eg. None in an integer column, a timezone-aware date in a datetime64 column, None is stored as nan in a float column) : fall back to an object column
+            dtypes = [array.dtype for array in self._arrays]
+            dtypes[column_index] = np.dtype(object)
+            self._allocate(dtypes, arrays= self._arrays)
+            self._view(column_index, t)[t] = value
+    def _view(self, column_index, t):
+        # Integer indexes are already resolved against self.size, slices and arrays are applied on the filled part only (with ring, every index is already resolved)
+        if self.ring or isinstance(t, (int, np.integer)): return self._arrays[column_index]
+        return self._arrays[column_index][:self.size]
+    def add(self, **kwargs):
+        values = self._flatten(kwargs)
+        if self.ring and self.size == self.height:
+            # Overwrite the oldest step
+            t = self._start
+            self._start = (self._start + 1) % self.height
+        else:
+            t = (self._start + self.size) % self.height if self.ring else self.size
+        try:
+            self._storage[t] = tuple(values)
+        except (TypeError, ValueError, OverflowError, UserWarning):
+            self._check_layout(kwargs)
+            for column_index, value in enumerate(values):
+                self._write(column_index, t, value)
+        self.size = min(self.size+1, self.height)
+    def extend(self, **kwargs):
+        # Same as add, but every value is a 1D array holding several consecutive steps
+        values = self._flatten(kwargs)
+        length = len(values[0]) if len(values) > 0 else 0
+        if self.ring:
+            values = [value[max(0, length - self.height):] for value in values]
+            kept = min(length, self.height)
+            steps = (self._start + self.size + np.arange(kept)) % self.height
+            self._start = (self._start + max(0, self.size + kept - self.height)) % self.height
+            self.size = min(self.size + kept, self.height) - kept # Increased by kept below
+            length = kept
+        elif self.size + length > self.height:
+            raise ValueError(f"History of max size {self.height} can not store {length} more steps (current size : {self.size})")
         else:
-            raise ValueError(f"Make sur that your inputs match the initial ones... Initial ones : {self.columns}. New ones {columns}")
+            steps = slice(self.size, self.size + length)
+        for column_index, value in enumerate(values):
+            try:
+                self._arrays[column_index][steps] = value
+            except (TypeError, ValueError, OverflowError, UserWarning):
+                dtypes = [array.dtype for array in self._arrays]
+                dtypes[column_index] = np.dtype(object)
+                self._allocate(dtypes, arrays= self._arrays)
+                self._arrays[column_index][steps] = value
+        self.size += length
+    def _get_column_index(self, column):
+        try:
+            return self.column_indexes[column]
+        except KeyError as e:
+            raise ValueError(f"Feature {column} does not exist ... Check the available features : {self.columns}")
+    def _get_t(self, t):
+        if isinstance(t, (int, np.integer)):
+            if t < -self.size or t >= self.size:
+                raise IndexError(f"index {t} is out of bounds for History of size {self.size}")
+            t = t if t >= 0 else self.size + t
+            return (self._start + t) % self.height if self.ring else t
+        if self.ring:
+            return (self._start + np.arange(self.size)[t]) % self.height
+        return t
+    def _ordered(self, array):
+        # The filled part of an array, from the oldest step to the last one
+        if self._start == 0: return array[:self.size]
+        return array[(self._start + np.arange(self.size)) % self.height]
     def __len__(self):
         return self.size
+    def get_state(self):
+        # Used by TradingEnv.snapshot : without ring, the steps added later never modify the current ones, so the size is enough
+        if not self.ring: return (self.size, self._start, None)
+        return (self.size, self._start, [array.copy() for array in self._arrays])
+    def set_state(self, state):
+        self.size, self._start, arrays = state
+        if arrays is not None:
+            for array, saved_array in zip(self._arrays, arrays):
+                array[:] = saved_array
+    def row(self, t):
+        # Lazy alternative to history[t]
+        return HistoryRow(self, self._get_t(t))
     def __getitem__(self, arg):
+        if type(arg) is int or isinstance(arg, np.integer):
+            t = self._get_t(arg)
+            values = self._storage.item(t)
+            if len(self._time_indexes) == 0: return dict(zip(self.columns, values))
+            values = list(values)
+            for column_index in self._time_indexes: values[column_index] = self._arrays[column_index][t]
+            return dict(zip(self.columns, values))
         if isinstance(arg, tuple):
             column, t = arg
-            try:
-                column_index = self.columns.index(column)
-            except ValueError as e:
-                raise ValueError(f"Feature {column} does not exist ... Check the available features : {self.columns}")
-            return self.history_storage[:self.size][t, column_index]
-        if isinstance(arg, int):
-            t = arg
-            return dict(zip(self.columns, self.history_storage[:self.size][t]))
+            column_index = self._get_column_index(column)
+            t = self._get_t(t)
+            return self._view(column_index, t)[t]
         if isinstance(arg, str):
-            column = arg
-            try:
-                column_index = self.columns.index(column)
-            except ValueError as e:
-                raise ValueError(f"Feature {column} does not exist ... Check the available features : {self.columns}")
-            return self.history_storage[:self.size][:, column_index]
+            return self._ordered(self._arrays[self._get_column_index(arg)])
         if isinstance(arg, list):
-            columns = arg
-            column_indexes = []
-            for column in columns:
-                try:
-                    column_indexes.append(self.columns.index(column))
-                except ValueError as e:
-                    raise ValueError(f"Feature {column} does not exist ... Check the available features : {self.columns}")
-            return self.history_storage[:self.size][:, column_indexes]
+            arrays = [self._ordered(self._arrays[self._get_column_index(column)]) for column in arg]
+            if len(set(array.dtype for array in arrays)) <= 1:
+                return np.stack(arrays, axis = 1) if len(arrays) > 0 else np.zeros(shape=(self.size, 0))
+            # Mixed dtypes : keep numpy scalars (eg. datetime64) as they are in an object matrix
+            matrix = np.empty(shape=(self.size, len(arrays)), dtype= object)
+            for i, array in enumerate(arrays):
+                matrix[:, i] = list(array)
+            return matrix
 
     def __setitem__(self, arg, value):
         column, t = arg
+        self._write(self._get_column_index(column), self._get_t(t), value)
+
+class HistoryRow(Mapping):
+    """Read-only view on one step of a History : values are only read when accessed."""
+    def __init__(self, history, t):
+        self.history = history
+        self.t = t
+    def __getitem__(self, column):
         try:
-            column_index = self.columns.index(column)
-        except ValueError as e:
-            raise ValueError(f"Feature {column} does not exist ... Check the available features : {self.columns}")
-        self.history_storage[:self.size][t, column_index] = value
\ No newline at end of file
+            return self.history.history_storage[column][self.t]
+        except KeyError:
+            raise KeyError(column)
+    def __iter__(self):
+        return iter(self.history.columns)
+    def __len__(self):
+        return self.history.width
+    def __repr__(self):
+        return f"{self.__class__.__name__}({dict(self)})"
+    def __reduce__(self):
+        # Pickled as a plain dict of its own step (eg. info sent by AsyncVectorEnv), not with the whole History
+        return (dict, (dict(self),))
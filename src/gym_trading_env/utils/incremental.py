@@ -0,0 +1,19 @@
+class IncrementalFunction:
+    """
+    Base class of the built-in reward functions and dynamic features.
+    Instead of reading the History at every step, they keep a small running state that the environment updates in O(1) :
+    ``reset`` is called at the start of an episode and ``update`` at every step. Both return the current value (also stored in ``self.value``).
+    """
+    def reset(self, valuation, position, real_position, price):
+        self.value = 0.
+        return self.value
+    def update(self, valuation, position, real_position, price):
+        raise NotImplementedError
+    def get_state(self):
+        # Running state (nested built-in functions included), captured by TradingEnv.snapshot. Subclasses holding mutable objects must copy them.
+        return {key : value.get_state() if isinstance(value, IncrementalFunction) else value for key, value in self.__dict__.items()}
+    def set_state(self, state):
+        for key, value in state.items():
+            attribute = self.__dict__.get(key)
+            if isinstance(attribute, IncrementalFunction): attribute.set_state(value)
+            else: setattr(self, key, value)
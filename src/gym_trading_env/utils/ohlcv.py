@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+MS_PER_DAY = 24 * 3600 * 1000
+# Weekly bars of the exchanges open on Monday (1970-01-05), not on the Thursday of the epoch
+WEEK_ORIGIN = 4 * MS_PER_DAY
+
+def timeframe_ms(timeframe):
+    return int(pd.Timedelta(timeframe) // pd.Timedelta(milliseconds= 1))
+
+def resample_ohlcv(df, timeframe, drop_incomplete_first = True, drop_incomplete_last = True, source_timeframe = None):
+    """
+    Aggregate OHLCV candles into bars of a coarser ``timeframe`` : first open, highest high, lowest low, last close and summed volume.
+    The bars are aligned on the boundaries used by the exchanges (multiples of the timeframe since 1970-01-01 UTC, Mondays for weekly bars) and ``date_close`` (if present) is computed again.
+    Other columns are dropped.
+
+    :param df: Candles indexed by their open date, with the columns open, high, low, close and volume.
+    :type df: pandas.DataFrame
+
+    :param timeframe: Timeframe of the bars (eg. '4h'). It must be a multiple of the timeframe of ``df``.
+    :type timeframe: str
+
+    :param drop_incomplete_first: If True (default), the first bar is dropped when ``df`` starts after its open : the candles at the beginning of the bar are missing.
+    :type drop_incomplete_first: optional - bool
+
+    :param drop_incomplete_last: If True (default), the last bar is dropped when the candles of ``df`` end before its close : the bar is not over yet, or its last candles are missing.
+    :type drop_incomplete_last: optional - bool
+
+    :param source_timeframe: Timeframe of the candles of ``df`` (eg. '5m'), used to know when the last candle closes. Default is None : deduced from ``date_close`` if present, otherwise from the smallest interval between two candles.
+    :type source_timeframe: optional - str
+
+    :rtype: pandas.DataFrame
+    """
+    if not df.index.is_monotonic_increasing: df = df.sort_index()
+    timedelta = timeframe_ms(timeframe)
+    origin = WEEK_ORIGIN if timedelta % (7 * MS_PER_DAY) == 0 else 0
+    timestamps = df.index.values.astype("datetime64[ms]").astype(np.int64)
+    buckets = (timestamps - origin) // timedelta * timedelta + origin
+    starts = np.flatnonzero(np.concatenate([[True], buckets[1:] != buckets[:-1]]))
+    if drop_incomplete_first and len(starts) > 0 and buckets[0] < timestamps[0]: starts = starts[1:]
+    if drop_incomplete_last and len(starts) > 0:
+        source_timedelta = _candle_timedelta(df, timestamps) if source_timeframe is None else timeframe_ms(source_timeframe)
+        if source_timedelta is not None and timestamps[-1] + source_timedelta < buckets[-1] + timedelta:
+            # The candles of the last bar are not aggregated either
+            df, buckets = df.iloc[:starts[-1]], buckets[:starts[-1]]
+            starts = starts[:-1]
+    if len(starts) == 0: return df.iloc[:0][[column for column in ["open", "high", "low", "close", "volume", "date_close"] if column in df.columns]]
+    stops = np.concatenate([starts[1:], [len(df)]])
+    columns = {
+        "open" : df["open"].to_numpy()[starts],
+        "high" : np.maximum.reduceat(df["high"].to_numpy(), starts),
+        "low" : np.minimum.reduceat(df["low"].to_numpy(), starts),
+        "close" : df["close"].to_numpy()[stops - 1],
+        "volume" : np.add.reduceat(df["volume"].to_numpy(), starts),
+    }
+    index = _to_index(buckets[starts], df.index)
+    if "date_close" in df.columns: columns["date_close"] = _to_index(buckets[starts] + timedelta, df.index).to_numpy()
+    return pd.DataFrame(columns, index= index)
+
+def _candle_timedelta(df, timestamps):
+    # Duration of the candles of df in milliseconds (None when it can not be known)
+    if "date_close" in df.columns: return int(pd.DatetimeIndex(df["date_close"].iloc[-1:]).values.astype("datetime64[ms]").astype(np.int64)[0] - timestamps[-1])
+    intervals = np.diff(timestamps)
+    intervals = intervals[intervals > 0]
+    return int(intervals.min()) if len(intervals) > 0 else None
+
+def _to_index(timestamps, like):
+    # DatetimeIndex with the unit, timezone and name of like
+    index = pd.DatetimeIndex(timestamps.astype("datetime64[ms]"))
+    if like.tz is not None: index = index.tz_localize("UTC").tz_convert(like.tz)
+    else: index = index.astype(like.dtype)
+    return index.rename(like.name)
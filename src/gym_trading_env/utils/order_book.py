@@ -0,0 +1,90 @@
+import numpy as np
+
+GOOD_TILL_CANCELLED = np.iinfo(np.int64).max
+
+class LimitOrderBook:
+    """Pending limit orders, stored in numpy arrays so that trigger checks are done for every order at once."""
+    def __init__(self, capacity = 16):
+        self.capacity = capacity
+        self.ids = np.zeros(shape= (capacity, ), dtype= np.int64)
+        self.positions = np.zeros(shape= (capacity, ), dtype= np.float64)
+        self.limits = np.zeros(shape= (capacity, ), dtype= np.float64)
+        self.persistent = np.zeros(shape= (capacity, ), dtype= bool)
+        self.expiries = np.zeros(shape= (capacity, ), dtype= np.int64)
+        self.active = np.zeros(shape= (capacity, ), dtype= bool)
+        self.size = 0
+        self._nb_active = 0
+        self._next_id = 0
+    def _compact(self):
+        # Drop the slots of the inactive orders, keeping the insertion order
+        keep = np.flatnonzero(self.active[:self.size])
+        for array in [self.ids, self.positions, self.limits, self.persistent, self.expiries, self.active]:
+            array[:len(keep)] = array[keep]
+        self.active[len(keep):self.size] = False
+        self.size = len(keep)
+    def _grow(self):
+        self.capacity *= 2
+        for name in ["ids", "positions", "limits", "persistent", "expiries", "active"]:
+            array = getattr(self, name)
+            new_array = np.zeros(shape= (self.capacity, ), dtype= array.dtype)
+            new_array[:self.size] = array[:self.size]
+            setattr(self, name, new_array)
+    def add(self, position, limit, persistent = False, expiry = GOOD_TILL_CANCELLED, replace = False):
+        if replace:
+            # The new order takes the place of the first pending order with the same position
+            slots = np.flatnonzero((self.positions[:self.size] == position) & self.active[:self.size])
+            if len(slots) > 0:
+                for slot in slots[1:]: self.remove(slot)
+                i = slots[0]
+                self.ids[i], self.limits[i], self.persistent[i], self.expiries[i] = self._next_id, limit, persistent, expiry
+                self._next_id += 1
+                return self._next_id - 1
+        if self.size >= self.capacity:
+            self._compact()
+            if self.size >= self.capacity: self._grow()
+        i = self.size
+        self.ids[i], self.positions[i], self.limits[i] = self._next_id, position, limit
+        self.persistent[i], self.expiries[i], self.active[i] = persistent, expiry, True
+        self.size += 1
+        self._nb_active += 1
+        self._next_id += 1
+        return self._next_id - 1
+    def copy(self):
+        # Copy holding only the pending orders
+        book = LimitOrderBook(capacity= max(self._nb_active, 1))
+        slots = np.flatnonzero(self.active[:self.size])
+        for name in ["ids", "positions", "limits", "persistent", "expiries", "active"]:
+            getattr(book, name)[:len(slots)] = getattr(self, name)[slots]
+        book.size = book._nb_active = len(slots)
+        book._next_id = self._next_id
+        return book
+    def remove(self, slot):
+        if self.active[slot]:
+            self.active[slot] = False
+            self._nb_active -= 1
+    def cancel(self, order_id):
+        slots = np.flatnonzero((self.ids[:self.size] == order_id) & self.active[:self.size])
+        for slot in slots: self.remove(slot)
+        return len(slots) > 0
+    def clear(self):
+        self.active[:self.size] = False
+        self.size = 0
+        self._nb_active = 0
+    def expire(self, idx):
+        expired = np.flatnonzero(self.active[:self.size] & (self.expiries[:self.size] < idx))
+        for slot in expired: self.remove(slot)
+    def triggered(self, low, high):
+        # Slots (in insertion order) of the active orders whose limit is inside the [low, high] range of the candle
+        limits = self.limits[:self.size]
+        return np.flatnonzero(self.active[:self.size] & (limits <= high) & (limits >= low))
+    def __len__(self):
+        return self._nb_active
+    def __iter__(self):
+        for slot in np.flatnonzero(self.active[:self.size]):
+            yield {
+                'id' : int(self.ids[slot]),
+                'position' : self.positions[slot],
+                'limit' : self.limits[slot],
+                'persistent' : bool(self.persistent[slot]),
+                'expiry' : None if self.expiries[slot] == GOOD_TILL_CANCELLED else int(self.expiries[slot]),
+            }
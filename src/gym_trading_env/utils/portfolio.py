@@ -1,3 +1,5 @@
+import numpy as np
+
 class Portfolio:
     def __init__(self, asset, fiat, interest_asset = 0, interest_fiat = 0):
         self.asset =asset
@@ -36,11 +38,15 @@ class Portfolio:
             asset_fiat = - asset_trade * price
             self.asset = self.asset + asset_trade * (1 - trading_fees)
             self.fiat = self.fiat + asset_fiat
+            fees = asset_trade * trading_fees * price
         else:
             asset_trade = asset_trade / (1 - trading_fees * position)
             asset_fiat = - asset_trade * price
             self.asset = self.asset + asset_trade 
             self.fiat = self.fiat + asset_fiat * (1 - trading_fees)
+            fees = asset_fiat * trading_fees
+        # Traded value and fees paid (in fiat)
+        return abs(asset_trade) * price, fees
     def update_interest(self, borrow_interest_rate):
         self.interest_asset = max(0, - self.asset)*borrow_interest_rate
         self.interest_fiat = max(0, - self.fiat)*borrow_interest_rate
@@ -64,3 +70,63 @@ class TargetPortfolio(Portfolio):
             interest_asset = 0,
             interest_fiat = 0
         )
+
+
+class BatchPortfolio:
+    """Vectorized version of Portfolio : every attribute is a np.array holding the state of N portfolios."""
+    def __init__(self, asset, fiat, interest_asset = 0, interest_fiat = 0):
+        self.asset = np.array(asset, dtype= np.float64)
+        self.fiat = np.array(fiat, dtype= np.float64)
+        self.interest_asset = np.broadcast_to(np.array(interest_asset, dtype= np.float64), self.asset.shape).copy()
+        self.interest_fiat = np.broadcast_to(np.array(interest_fiat, dtype= np.float64), self.asset.shape).copy()
+    def valorisation(self, price):
+        return self.asset * price + self.fiat - self.interest_asset * price - self.interest_fiat
+    def real_position(self, price):
+        return (self.asset - self.interest_asset)* price / self.valorisation(price)
+    def position(self, price):
+        return self.asset * price / self.valorisation(price)
+    def trade_to_position(self, position, price, trading_fees, mask = None):
+        # Same computation as Portfolio.trade_to_position, applied only where mask is True
+        if mask is None: mask = np.ones(shape= self.asset.shape, dtype= bool)
+        with np.errstate(divide= "ignore", invalid= "ignore"):
+            # Repay interest
+            current_position = self.position(price)
+            interest_reduction_ratio = np.ones(shape= self.asset.shape)
+            short_repay = (position <= 0) & (current_position < 0)
+            interest_reduction_ratio = np.where(short_repay, np.minimum(1, position/current_position), interest_reduction_ratio)
+            long_repay = (position >= 1) & (current_position > 1)
+            interest_reduction_ratio = np.where(long_repay, np.minimum(1, (position-1)/(current_position-1)), interest_reduction_ratio)
+            repay = mask & (interest_reduction_ratio < 1)
+            self.asset = np.where(repay, self.asset - (1-interest_reduction_ratio) * self.interest_asset, self.asset)
+            self.fiat = np.where(repay, self.fiat - (1-interest_reduction_ratio) * self.interest_fiat, self.fiat)
+            self.interest_asset = np.where(repay, interest_reduction_ratio * self.interest_asset, self.interest_asset)
+            self.interest_fiat = np.where(repay, interest_reduction_ratio * self.interest_fiat, self.interest_fiat)
+
+            # Proceed to trade
+            asset_trade = (position * self.valorisation(price) / price - self.asset)
+            buy = asset_trade > 0
+            asset_trade = np.where(buy,
+                asset_trade / (1 - trading_fees + trading_fees * position),
+                asset_trade / (1 - trading_fees * position)
+            )
+            asset_fiat = - asset_trade * price
+            self.asset = np.where(mask, self.asset + np.where(buy, asset_trade * (1 - trading_fees), asset_trade), self.asset)
+            self.fiat = np.where(mask, self.fiat + np.where(buy, asset_fiat, asset_fiat * (1 - trading_fees)), self.fiat)
+    def update_interest(self, borrow_interest_rate):
+        self.interest_asset = np.maximum(0, - self.asset)*borrow_interest_rate
+        self.interest_fiat = np.maximum(0, - self.fiat)*borrow_interest_rate
+    def reset(self, mask, position, value, price):
+        # Same initial state as TargetPortfolio, for the portfolios selected by mask
+        self.asset = np.where(mask, position * value / price, self.asset)
+        self.fiat = np.where(mask, (1-position) * value, self.fiat)
+        self.interest_asset = np.where(mask, 0., self.interest_asset)
+        self.interest_fiat = np.where(mask, 0., self.interest_fiat)
+    def get_portfolio_distribution(self):
+        return {
+            "asset":np.maximum(0, self.asset),
+            "fiat":np.maximum(0, self.fiat),
+            "borrowed_asset":np.maximum(0, -self.asset),
+            "borrowed_fiat":np.maximum(0, -self.fiat),
+            "interest_asset":self.interest_asset,
+            "interest_fiat":self.interest_fiat,
+        }
@@ -0,0 +1,68 @@
+from time import perf_counter
+
+# Phases of TradingEnv.reset and TradingEnv.step, in order
+PHASES = ["dataset", "reset", "action", "limit_orders", "interest", "valuation", "history", "dynamic_features", "metrics", "reward", "episode_end", "observation"]
+# Phases spent in the functions written by the user (reward_function and dynamic_feature_functions defined outside of the package)
+USER_PHASES = ["dynamic_features", "reward"]
+
+class StepProfiler:
+    """
+    Cumulative time and number of calls of every phase of ``reset`` and ``step``.
+    ``start()`` begins the measure, then each ``lap(phase)`` adds the time elapsed since the previous call to ``phase``.
+    """
+    def __init__(self):
+        self.clear()
+    def clear(self):
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self.calls = dict.fromkeys(PHASES, 0)
+        self.steps = 0
+        self.resets = 0
+        self._last = perf_counter()
+    def start(self):
+        self._last = perf_counter()
+    def lap(self, phase):
+        now = perf_counter()
+        self.times[phase] += now - self._last
+        self.calls[phase] += 1
+        self._last = now
+    def stats(self):
+        return make_profile(
+            phases= {phase : {"time" : self.times[phase], "calls" : self.calls[phase]} for phase in PHASES},
+            steps= self.steps,
+            resets= self.resets,
+        )
+
+def make_profile(phases, steps, resets):
+    user_time = sum(phases[phase]["time"] for phase in USER_PHASES)
+    total_time = sum(phase["time"] for phase in phases.values())
+    return {
+        "phases" : phases,
+        "steps" : steps,
+        "resets" : resets,
+        "total_time" : total_time,
+        "user_time" : user_time,
+        "env_time" : total_time - user_time,
+    }
+
+def merge_profiles(profiles):
+    """
+    Sum the profiles of several environments (eg. the workers of a vectorized environment : ``merge_profiles(envs.call('get_profile'))``).
+
+    :param profiles: Profiles returned by ``TradingEnv.get_profile()``.
+    :type profiles: list[dict]
+
+    :return: A profile with the same keys, holding the sum of every profile.
+    :rtype: dict
+    """
+    profiles = [profile for profile in profiles if profile is not None]
+    return make_profile(
+        phases= {
+            phase : {
+                "time" : sum(profile["phases"][phase]["time"] for profile in profiles),
+                "calls" : sum(profile["phases"][phase]["calls"] for profile in profiles),
+            }
+            for phase in PHASES
+        },
+        steps= sum(profile["steps"] for profile in profiles),
+        resets= sum(profile["resets"] for profile in profiles),
+    )
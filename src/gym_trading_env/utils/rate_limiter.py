@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+class RateLimiter:
+    """
+    Adaptive token bucket shared by every request sent to one exchange.
+    Requests consume one token each and the tokens refill at ``rate`` per second (up to ``burst``), with at most ``max_concurrency`` requests in flight.
+    The rate slowly increases (up to ``max_rate``) while the requests succeed quickly. It is halved when the exchange rejects a request for exceeding its rate limit
+    (the requests are then paused for a moment) and decreases when the latency of the responses rises, a sign that the exchange is overloaded.
+
+    :param rate: Initial number of requests per second.
+    :type rate: float
+
+    :param burst: Number of requests that can be sent at once after a pause.
+    :type burst: optional - int
+
+    :param max_concurrency: Maximum number of requests waiting for their response.
+    :type max_concurrency: optional - int
+
+    :param max_rate: Maximum number of requests per second. Default is twice the initial rate.
+    :type max_rate: optional - float
+
+    :param min_rate: Minimum number of requests per second. Default is a tenth of the initial rate.
+    :type min_rate: optional - float
+    """
+    def __init__(self, rate, burst = 1, max_concurrency = 4, max_rate = None, min_rate = None, increase = 0.05, latency_factor = 3):
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self.max_concurrency = max_concurrency
+        self.max_rate = 2 * self.rate if max_rate is None else max_rate
+        self.min_rate = self.rate / 10 if min_rate is None else min_rate
+        self.increase = increase * self.rate
+        self.latency_factor = latency_factor
+        self.latency = None
+        self.min_latency = None
+        self._tokens = float(self.burst)
+        self._last_refill = time.monotonic()
+        self._paused_until = 0
+        self._semaphore = None
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    async def acquire(self):
+        # Wait for a token (and for the end of a pause)
+        while True:
+            now = time.monotonic()
+            self._refill(now)
+            wait = self._paused_until - now
+            if wait <= 0 and self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep(max(wait, (1 - self._tokens) / self.rate))
+
+    async def run(self, function, *args, **kwargs):
+        """Await ``function(*args, **kwargs)`` once a token is available and the number of requests in flight allows it."""
+        # The semaphore is created in the event loop running the requests
+        if self._semaphore is None: self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            await self.acquire()
+            start = time.monotonic()
+            result = await function(*args, **kwargs)
+            self.on_success(time.monotonic() - start)
+            return result
+
+    def on_success(self, latency):
+        # Exponential moving average of the latency, compared to the lowest average seen
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        self.min_latency = self.latency if self.min_latency is None else min(self.min_latency, self.latency)
+        if self.latency > self.latency_factor * self.min_latency:
+            self.rate = max(self.min_rate, self.rate * 0.9)
+        else:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_rate_limit(self):
+        self.rate = max(self.min_rate, self.rate / 2)
+        self._tokens = 0
+        self._paused_until = max(self._paused_until, time.monotonic() + 1 / self.rate)
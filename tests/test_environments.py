@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+from gym_trading_env.environments import TradingEnv, MultiDatasetTradingEnv
+
+def make_ohlcv(length, seed = 0, start = "2020-01-01"):
+    # Hourly geometric random walk with one feature
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, size= length)))
+    open_price = np.concatenate([[100], close[:-1]])
+    return pd.DataFrame({
+        "open" : open_price,
+        "high" : np.maximum(open_price, close) * 1.001,
+        "low" : np.minimum(open_price, close) * 0.999,
+        "close" : close,
+        "volume" : rng.lognormal(10, 1, size= length),
+        "feature_close" : pd.Series(close).pct_change().fillna(0).to_numpy(),
+    }, index= pd.date_range(start, periods= length, freq= "h", name= "date"))
+
+@pytest.mark.parametrize("parameters, seed", [
+    ({"positions" : [-1, 0, 1], "trading_fees" : 0.01/100, "borrow_interest_rate" : 0.0003/100, "initial_position" : 0}, 0),
+    # The portfolio is ruined during the episode : the actions after the ruin are never taken
+    ({"positions" : [-20, 20], "trading_fees" : 0.01, "borrow_interest_rate" : 0.001, "initial_position" : 20}, 1),
+], ids= ["no_ruin", "ruin"])
+def test_backtest_matches_steps(parameters, seed):
+    df = make_ohlcv(5000)
+    actions = np.random.default_rng(seed).integers(len(parameters["positions"]), size= len(df))
+    env = TradingEnv(df= df, verbose= 0, **parameters)
+    env.reset(seed= 0)
+    for action in actions:
+        _, _, done, truncated, _ = env.step(action)
+        if done or truncated: break
+    stepped = env.historical_info
+    backtested = TradingEnv(df= df, verbose= 0, **parameters).backtest(actions)
+    assert len(backtested) == len(stepped)
+    for column in ["idx", "position", "real_position", "portfolio_valuation", "reward"]:
+        np.testing.assert_allclose(backtested[column], stepped[column], err_msg= column)
+
+@pytest.mark.parametrize("dataset_sampling", ["uniform", "length"])
+def test_save_for_render_with_datasets_on_the_same_dates(tmp_path, dataset_sampling):
+    datasets = {f"dataset_{i}.pkl" : make_ohlcv(500, seed= i) for i in range(2)}
+    for name, df in datasets.items(): df.to_pickle(tmp_path / name)
+    env = MultiDatasetTradingEnv(dataset_dir= str(tmp_path / "*.pkl"), dataset_sampling= dataset_sampling, positions= [-1, 0, 1], max_episode_duration= 100, verbose= 0)
+    env.reset(seed= 0)
+    for _ in range(99): env.step(1)
+    env.save_for_render(dir= tmp_path / "render_logs")
+    render_df = pd.read_pickle(next((tmp_path / "render_logs").iterdir()))
+    assert len(render_df) == 100
+    df = datasets[env.name]
+    np.testing.assert_allclose(render_df["close"], df.loc[render_df.index, "close"])
+    np.testing.assert_array_equal(render_df.index, df.index[env.historical_info["idx"] - env._segment_bounds[env.dataset_pathes.index(env._dataset_path)]])
@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+from gym_trading_env.environments import TradingEnv
+from gym_trading_env.utils.history import History
+
+def test_timezone_aware_dates_are_kept():
+    history = History(max_size= 10)
+    date = pd.Timestamp("2020-01-01 01:00", tz= "UTC")
+    history.set(step = 0, date_close = date)
+    history.add(step = 1, date_close = date + pd.Timedelta(hours= 1))
+    assert history["date_close", 0] == date
+    assert history["date_close", -1] == date + pd.Timedelta(hours= 1)
+
+def test_timezone_aware_date_in_a_datetime64_column():
+    history = History(max_size= 10)
+    history.set(step = 0, date_close = pd.Timestamp("2020-01-01 01:00"))
+    history.add(step = 1, date_close = pd.Timestamp("2020-01-01 02:00", tz= "UTC"))
+    assert history["date_close", -1] == pd.Timestamp("2020-01-01 02:00", tz= "UTC")
+
+def test_timezone_aware_info_column():
+    index = pd.date_range("2020-01-01", periods= 50, freq= "h", tz= "UTC", name= "date")
+    df = pd.DataFrame({
+        "open" : 100.0, "high" : 101.0, "low" : 99.0, "close" : 100.0, "volume" : 1.0,
+        "feature_close" : 0.0, "date_close" : index + pd.Timedelta(hours= 1),
+    }, index= index)
+    env = TradingEnv(df= df, positions= [0, 1], verbose= 0)
+    env.reset(seed= 0)
+    _, _, _, _, info = env.step(1)
+    assert info["data_date_close"] == df["date_close"].iloc[1]
+    assert env.historical_info["data_date_close", -1] == df["date_close"].iloc[1]